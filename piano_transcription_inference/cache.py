@@ -0,0 +1,166 @@
+import os
+import json
+import shutil
+import tempfile
+import hashlib
+import argparse
+
+import numpy as np
+
+from . import config
+
+
+def get_audio_sha256(audio):
+    """sha256 of the float32 samples of audio."""
+    audio = np.ascontiguousarray(audio, dtype=np.float32)
+    return hashlib.sha256(memoryview(audio).cast('B')).hexdigest()
+
+
+def get_cache_key(audio_sha256, model_sha256, settings):
+    """Key of the model outputs of an audio, a model and the settings that
+    change the outputs, e.g. segment_samples.
+
+    Args:
+      audio_sha256: str
+      model_sha256: None | str, None for features, which only depend on the
+        front-end in settings
+      settings: dict, JSON serializable
+
+    Returns:
+      key: str
+    """
+    description = json.dumps({'audio': audio_sha256, 'model': model_sha256,
+        'settings': settings}, sort_keys=True)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+class OutputCache(object):
+    def __init__(self, cache_dir, max_bytes=config.cache_max_bytes):
+        """On-disk cache of dicts of arrays: deframed output_dicts, so that 
+        re-running an audio with other thresholds only re-runs the post 
+        processing, or log mel features of segments, shared by models with 
+        the same front-end.
+
+        Each entry is a directory named by its key, with one .npy file per
+        array, loaded memory-mapped. The least recently used entries are
+        evicted when the cache grows over max_bytes. The modification time of
+        an entry directory is its last use.
+
+        Args:
+          cache_dir: str
+          max_bytes: int | float
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key):
+        """Load the outputs of key, memory-mapped and read-only.
+
+        Returns:
+          output_dict: None | dict, None if key is not in the cache
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+
+        try:
+            names = sorted(os.listdir(entry_dir))
+            output_dict = {os.path.splitext(name)[0]: np.load(
+                os.path.join(entry_dir, name), mmap_mode='r') for name in names}
+            os.utime(entry_dir)
+        except FileNotFoundError:
+            # Not cached, or evicted meanwhile
+            return None
+
+        return output_dict
+
+    def put(self, key, output_dict):
+        """Save the outputs of key and evict least recently used entries.
+
+        Args:
+          key: str
+          output_dict: dict, e.g. {'reg_onset_output': (frames_num, classes_num), ...}
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry_dir):
+            os.utime(entry_dir)
+            return
+
+        # Written aside and renamed, so that an entry is either complete or
+        # missing, also for other threads and processes sharing cache_dir
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.' + key)
+
+        try:
+            for name in output_dict.keys():
+                np.save(os.path.join(tmp_dir, '{}.npy'.format(name)), 
+                    output_dict[name])
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(entry_dir):
+                raise
+            # Saved by another thread or process meanwhile
+            os.utime(entry_dir)
+            return
+
+        self.evict()
+
+    def get_entries(self):
+        """Returns:
+          entries: list of (last_use, bytes, key), least recently used first
+        """
+        entries = []
+
+        for key in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, key)
+            if key.startswith('.') or not os.path.isdir(entry_dir):
+                continue
+            try:
+                last_use = os.path.getmtime(entry_dir)
+                entry_bytes = sum(os.path.getsize(os.path.join(entry_dir, name))
+                    for name in os.listdir(entry_dir))
+            except FileNotFoundError:
+                continue
+            entries.append((last_use, entry_bytes, key))
+
+        return sorted(entries)
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_bytes.
+        Arrays already loaded from a removed entry stay readable.
+
+        Returns:
+          evicted_keys: list of str
+        """
+        entries = self.get_entries()
+        total_bytes = sum(entry[1] for entry in entries)
+        evicted_keys = []
+
+        for (_, entry_bytes, key) in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total_bytes -= entry_bytes
+            evicted_keys.append(key)
+
+        return evicted_keys
+
+    def clear(self):
+        for (_, _, key) in self.get_entries():
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Size or clear a cache of '
+        'model outputs.')
+    parser.add_argument('cache_dir', type=str)
+    parser.add_argument('--clear', action='store_true', default=False)
+    args = parser.parse_args()
+
+    cache = OutputCache(args.cache_dir)
+
+    if args.clear:
+        cache.clear()
+
+    entries = cache.get_entries()
+    print('{} entries, {:.1f} MB'.format(len(entries),
+        sum(entry[1] for entry in entries) / 1e6))
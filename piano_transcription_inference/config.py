@@ -1,7 +1,26 @@
+import os
+
 sample_rate = 16000
 classes_num = 88    # Number of notes of piano
 begin_note = 21     # MIDI note of A0, the lowest note of a piano.
 segment_seconds = 10.	# Training segment duration
 hop_seconds = 1.
 frames_per_second = 100
-velocity_scale = 128
\ No newline at end of file
+velocity_scale = 128
+
+# Rough peak activation memory of Note_pedal per second of audio in a batch,
+# used by batch_size='auto'.
+forward_bytes_per_second = 15e6
+memory_budget = 2e9     # Bytes available for a forward batch in 'auto' mode
+
+# Memory-mapped models converted by registry.convert_checkpoint()
+registry_dir = os.path.join(os.path.expanduser('~'), 
+    'piano_transcription_inference_data', 'registry')
+
+# Size of the cache of model outputs of PianoTranscription(cache_dir=...)
+cache_max_bytes = 10e9
+
+# Logistic velocity curves of soundfonts, {soundfont}_coefficients.txt, in 
+# the SOURCES directory of the repository
+coefficients_dir = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'SOURCES', 'SF_COEFFICIENTS')
@@ -0,0 +1,90 @@
+import time
+import argparse
+
+from .inference import PianoTranscription
+from .utilities import load_audio, get_note_drift
+from . import config
+
+
+def get_drift_report(audios, settings_list, **kwargs):
+    """Transcribe reference audio, e.g. audio synthesized by 0_SYNTH.ipynb,
+    with PianoTranscription under each settings. The notes transcribed under
+    the first settings are the reference of the drift.
+
+    Args:
+      audios: list of (audio_samples,)
+      settings_list: list of dict, arguments of PianoTranscription that
+        differ between runs, e.g. [{'overlap': 0.5}, {'overlap': 0.25}]
+      kwargs: arguments of PianoTranscription shared by the runs, e.g.
+        checkpoint_path
+
+    Returns:
+      report: list of dict, one per settings, e.g. [{'f1': 1.,
+        'velocity_mae': 0., 'speed': ..., 'segments': ..., 'files': ...},
+        ...], where speed is seconds of audio transcribed per second,
+        segments is the number of segments forwarded and files is the drift
+        dict of each audio
+    """
+    ref_note_events = []
+    report = []
+
+    for settings in settings_list:
+        transcriptor = PianoTranscription(device='cpu', **settings, **kwargs)
+
+        seconds = 0.
+        segments_num = 0
+        files = []
+        ref_num = 0
+        f1_sum = 0.
+        velocity_error_sum = 0.
+
+        for (n, audio) in enumerate(audios):
+            start_time = time.time()
+            note_events = transcriptor.transcribe(audio, None)['est_note_events']
+            seconds += time.time() - start_time
+
+            segments_num += 1 + (transcriptor.get_padded_len(len(audio)) -
+                transcriptor.segment_samples) // transcriptor.hop_samples
+
+            if len(ref_note_events) < len(audios):
+                ref_note_events.append(note_events)
+
+            drift_dict = get_note_drift(ref_note_events[n], note_events)
+            files.append(drift_dict)
+
+            # Weight files by their number of notes
+            ref_num += len(ref_note_events[n])
+            f1_sum += drift_dict['f1'] * len(ref_note_events[n])
+            velocity_error_sum += drift_dict['velocity_mae'] * len(ref_note_events[n])
+
+        audio_seconds = sum(len(audio) for audio in audios) / config.sample_rate
+
+        report.append({'f1': f1_sum / max(ref_num, 1),
+            'velocity_mae': velocity_error_sum / max(ref_num, 1),
+            'speed': audio_seconds / seconds,
+            'segments': segments_num,
+            'files': files})
+
+    return report
+
+
+def get_report_parser(description):
+    """Command line arguments shared by the drift reports: the reference
+    audio paths and the checkpoint."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('audio_paths', type=str, nargs='+')
+    parser.add_argument('--checkpoint_path', type=str, default=None)
+    return parser
+
+
+def load_audios(audio_paths):
+    """Load reference audio for the drift reports.
+
+    Args:
+      audio_paths: list of str
+
+    Returns:
+      audios: list of (audio_samples,)
+    """
+    return [load_audio(path, sr=config.sample_rate, mono=True)[0]
+        for path in audio_paths]
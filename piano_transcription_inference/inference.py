@@ -6,16 +6,26 @@ from pathlib import Path
 
 import torch
 
-from .utilities import (create_folder, get_filename, RegressionPostProcessor, 
-    write_events_to_midi)
-from .models import Regress_onset_offset_frame_velocity_CRNN, Note_pedal
-from .pytorch_utils import move_data_to_device, forward
+from .utilities import (get_filename, RegressionPostProcessor, 
+    StreamingRegressionPostProcessor, write_events_to_midi, get_velocity_table)
+from .models import (Regress_onset_offset_frame_velocity_CRNN, Note_pedal, 
+    LogmelExtractor, LogmelModel)
+from .pytorch_utils import (forward, get_auto_batch_size, quantize_dynamic, 
+    export_for_inference, set_conv_dtype)
+from .registry import load_model, get_model_dir, get_sha256
+from .cache import OutputCache, get_audio_sha256, get_cache_key
 from . import config
 
 
 class PianoTranscription(object):
     def __init__(self, model_type='Note_pedal', checkpoint_path=None, 
-        segment_samples=16000*10, device=torch.device('cuda')):
+        segment_samples=16000*10, device=torch.device('cuda'), batch_size=1, 
+        memory_budget=config.memory_budget, outputs='all', pin_memory=False, 
+        overlap=0.5, silence_threshold=None, silence_guard_seconds=1., 
+        model_name=None, registry_dir=None, precision='fp32', script_path=None, 
+        cache_dir=None, cache_max_bytes=config.cache_max_bytes, 
+        feature_dir=None, feature_max_bytes=config.cache_max_bytes, tables=False, 
+        soundfont=None, coefficients_dir=None, verify=None):
         """Class for transcribing piano solo recording.
 
         Args:
@@ -23,91 +33,508 @@ class PianoTranscription(object):
           checkpoint_path: str
           segment_samples: int
           device: 'cuda' | 'cpu'
+          batch_size: int | 'auto', number of segments forwarded together. 
+            'auto' uses the largest batch estimated to fit in memory_budget.
+          memory_budget: float, bytes available for a forward batch
+          outputs: 'all' | 'notes_pedals' | 'notes', the heads of Note_pedal
+            to run. 'notes_pedals' runs everything used to detect notes and 
+            pedals, 'notes' only runs the note model.
+          pin_memory: bool, stage batches in page-locked memory for faster 
+            transfer to a CUDA device
+          overlap: float, fraction of a segment overlapped by the next segment.
+            Audio is forwarded about 1 / (1 - overlap) times, e.g. one hour 
+            is 719 segments of 10 s with 0.5, 480 with 0.25 and 400 with 0.1.
+            Only the middle of each segment
+            is kept when deframing, so a smaller overlap gives the model less
+            context around the kept frames. overlap_report.py measures the 
+            note F1 drift and speed of overlaps on reference audio.
+          silence_threshold: None | float, RMS level in dB below which audio 
+            is silent. Segments that are silent, together with 
+            silence_guard_seconds around them, are not forwarded and their 
+            outputs are zeros. None forwards every segment.
+          silence_guard_seconds: float
+          model_name: None | str, load this model of the registry, memory-mapped,
+            instead of checkpoint_path. See registry.convert_checkpoint().
+          registry_dir: None | str, default config.registry_dir
+          precision: 'fp32' | 'int8' | 'bf16', 'int8' quantizes the GRU and 
+            Linear layers for CPU inference. 'bf16' runs the conv blocks under
+            bfloat16 autocast and stores the frame, velocity and pedal maps in
+            float16. The onset and offset regression maps stay in float32, 
+            their peaks need the precision.
+          script_path: None | str, load a TorchScript model saved by export() 
+            instead of checkpoint_path or model_name
+          cache_dir: None | str, cache the model outputs of transcribe() in 
+            this directory. Transcribing the same audio again, e.g. with other
+            thresholds, then only runs the post processing. None disables it.
+          cache_max_bytes: int | float, least recently used outputs are 
+            evicted above this size
+          feature_dir: None | str, store the log mel features of the segments 
+            of transcribe() in this directory. Models with the same front-end,
+            e.g. Note_pedal and Regress_onset_offset_frame_velocity_CRNN, then 
+            start from the stored features of an audio. None disables it.
+          feature_max_bytes: int | float
+          tables: bool, return est_note_events and est_pedal_events as a 
+            NoteTable and a PedalTable, columns of arrays, instead of lists of
+            dict. The tables are also sequences of dict, built on first use.
+          soundfont: None | str, remap velocities by the velocity curves of 
+            the soundfont in coefficients_dir, e.g. 'Yamaha_C5', the same as 
+            4_POSTPROCESS_MIDI.ipynb does on the written MIDI
+          coefficients_dir: None | str, directory of the velocity curves, 
+            default config.coefficients_dir
+          verify: None | bool, check the sha256 of the model_name weights,
+            see registry.load_model(). None only checks it if the weights 
+            file changed since the conversion.
         """
-        if not checkpoint_path: 
-            checkpoint_path='{}/piano_transcription_inference_data/note_F1=0.9677_pedal_F1=0.9186.pth'.format(str(Path.home()))
-        print('Checkpoint path: {}'.format(checkpoint_path))
+        assert precision in ['fp32', 'int8', 'bf16']
+        assert not (feature_dir and script_path), \
+            'Exported models only forward audio, not log mel features.'
+        assert precision != 'int8' or 'cuda' not in str(device), \
+            'int8 inference is only supported on CPU.'
+
+        if script_path:
+            print('Script path: {}'.format(script_path))
+        elif model_name:
+            print('Model: {}'.format(model_name))
+        else:
+            if not checkpoint_path: 
+                checkpoint_path='{}/piano_transcription_inference_data/note_F1=0.9677_pedal_F1=0.9186.pth'.format(str(Path.home()))
+            print('Checkpoint path: {}'.format(checkpoint_path))
 
-        if not os.path.exists(checkpoint_path) or os.path.getsize(checkpoint_path) < 1.6e8:
-            create_folder(os.path.dirname(checkpoint_path))
-            print('Total size: ~165 MB')
-            zenodo_path = 'https://zenodo.org/record/4034264/files/CRNN_note_F1%3D0.9677_pedal_F1%3D0.9186.pth?download=1'
-            os.system('wget -O "{}" "{}"'.format(checkpoint_path, zenodo_path))
+            if not os.path.exists(checkpoint_path):
+                zenodo_path = 'https://zenodo.org/record/4034264/files/CRNN_note_F1%3D0.9677_pedal_F1%3D0.9186.pth?download=1'
+                raise FileNotFoundError('Checkpoint {} does not exist. Download '
+                    'it (~165 MB) from {}'.format(checkpoint_path, zenodo_path))
 
         print('Using {} for inference.'.format(device))
 
         self.segment_samples = segment_samples
+        self.hop_samples = int(round(segment_samples * (1. - overlap)))
+        hop_size = config.sample_rate // config.frames_per_second
+        assert 0. <= overlap < 1. and self.hop_samples % hop_size == 0 and \
+            (segment_samples - self.hop_samples) % (2 * hop_size) == 0, \
+            'Overlap must keep the same number of frames on both sides.'
+        self.batch_size = batch_size
+        self.memory_budget = memory_budget
+        self.pin_memory = pin_memory
+        self.silence_threshold = silence_threshold
+        self.silence_guard_seconds = silence_guard_seconds
         self.frames_per_second = config.frames_per_second
         self.classes_num = config.classes_num
         self.onset_threshold = 0.3
         self.offset_threshod = 0.3
         self.frame_threshold = 0.1
         self.pedal_offset_threshold = 0.2
+        self.tables = tables
+        self.velocity_table = get_velocity_table(soundfont, 
+            coefficients_dir) if soundfont else None
 
-        # Build model
-        Model = eval(model_type)
-        self.model = Model(frames_per_second=self.frames_per_second, 
-            classes_num=self.classes_num)
+        self.device = torch.device(device)
 
-        # Load model
-        checkpoint = torch.load(checkpoint_path, map_location=device)
-        self.model.load_state_dict(checkpoint['model'], strict=False)
+        if script_path:
+            # Exported models are already built, loaded and frozen
+            self.model = torch.jit.load(script_path, map_location=device)
+        else:
+            # Build model
+            Model = eval(model_type)
+            model_args = {'frames_per_second': self.frames_per_second, 
+                'classes_num': self.classes_num}
+            if model_type == 'Note_pedal':
+                model_args['outputs'] = outputs
+            self.model = Model(**model_args)
+
+            # Load model
+            if model_name:
+                state_dict = load_model(model_name, registry_dir, verify)
+                self.model.load_state_dict(state_dict, strict=False, assign=True)
+            else:
+                checkpoint = torch.load(checkpoint_path, map_location=device)
+                self.model.load_state_dict(checkpoint['model'], strict=False)
+
+            if precision == 'int8':
+                self.model = quantize_dynamic(self.model)
+            elif precision == 'bf16':
+                set_conv_dtype(self.model, torch.bfloat16)
+
+        if precision == 'bf16':
+            self.output_dtypes = {key: np.float16 for key in ['frame_output', 
+                'velocity_output', 'reg_pedal_onset_output', 'pedal_frame_output']}
+        else:
+            self.output_dtypes = None
+
+        # Cache of model outputs, keyed by the audio, the model file and the 
+        # settings that change the outputs
+        if cache_dir:
+            self.output_cache = OutputCache(cache_dir, cache_max_bytes)
+
+            if script_path:
+                model_path = script_path
+            elif model_name:
+                model_path = os.path.join(get_model_dir(model_name, registry_dir), 
+                    'weights.bin')
+            else:
+                model_path = checkpoint_path
+
+            self.model_sha256 = get_sha256(model_path)
+            self.cache_settings = {'model_type': model_type, 'outputs': outputs, 
+                'precision': precision, 'segment_samples': segment_samples, 
+                'hop_samples': self.hop_samples, 
+                'silence_threshold': silence_threshold, 
+                'silence_guard_seconds': silence_guard_seconds}
+        else:
+            self.output_cache = None
 
         # Parallel
         if 'cuda' in str(device):
-            self.model.to(device)
             print('GPU number: {}'.format(torch.cuda.device_count()))
-            self.model = torch.nn.DataParallel(self.model)
+            if not script_path:
+                self.model.to(device)
+                self.model = torch.nn.DataParallel(self.model)
         else:
             print('Using CPU.')
 
-    def transcribe(self, audio, midi_path):
+        # Store of log mel features, keyed by the audio and the front-end
+        if feature_dir:
+            self.feature_store = OutputCache(feature_dir, feature_max_bytes)
+
+            model = self.model.module if isinstance(self.model, 
+                torch.nn.DataParallel) else self.model
+            self.logmel_extractor = LogmelExtractor(model)
+            self.logmel_model = LogmelModel(model)
+
+            if 'cuda' in str(device):
+                self.logmel_extractor = torch.nn.DataParallel(self.logmel_extractor)
+                self.logmel_model = torch.nn.DataParallel(self.logmel_model)
+
+            self.feature_settings = {'front_end': model.front_end_dict, 
+                'segment_samples': segment_samples, 'hop_samples': self.hop_samples}
+        else:
+            self.feature_store = None
+
+    def transcribe(self, audio, midi_path, batch_size=None):
         """Transcribe an audio recording.
 
         Args:
           audio: (audio_samples,)
           midi_path: str, path to write out the transcribed MIDI.
+          batch_size: None | int | 'auto', overrides self.batch_size
 
         Returns:
-          transcribed_dict, dict: {'output_dict':, ..., 'est_note_events': ...}
+          transcribed_dict, dict: {'output_dict':, ..., 'est_note_events': ...,
+            'copy_dict': {'pad_bytes': ..., 'input_bytes': ..., ...}, 
+            'silence_dict': None | {'skipped_segments': ..., ...},
+            'cache_hit': bool}
 
         """
-        audio = audio[None, :]  # (1, audio_samples)
-
-        # Pad audio to be evenly divided by segment_samples
-        audio_len = audio.shape[1]
-        pad_len = int(np.ceil(audio_len / self.segment_samples))\
-            * self.segment_samples - audio_len
+        if self.output_cache is None and self.feature_store is None:
+            audio_sha256 = None
+        else:
+            audio_sha256 = get_audio_sha256(audio)
 
-        audio = np.concatenate((audio, np.zeros((1, pad_len))), axis=1)
+        # Cached outputs only need the post processing
+        if self.output_cache is None:
+            cache_key = None
+        else:
+            cache_key = get_cache_key(audio_sha256, self.model_sha256, 
+                self.cache_settings)
+            output_dict = self.output_cache.get(cache_key)
+
+            if output_dict is not None:
+                print('Using cached outputs {}'.format(cache_key))
+                transcribed_dict = self.postprocess(output_dict, midi_path)
+                transcribed_dict['copy_dict'] = {}
+                transcribed_dict['silence_dict'] = None
+                transcribed_dict['cache_hit'] = True
+                return transcribed_dict
+
+        copy_dict = {}
+        """Bytes copied in each step of the inference"""
+
+        # Pad audio to fit the last segment
+        audio_len = audio.shape[0]
+        pad_len = self.get_padded_len(audio_len) - audio_len
+
+        # The whole inference runs in float32
+        padded_audio = np.zeros((1, audio_len + pad_len), dtype=np.float32)
+        padded_audio[0, 0 : audio_len] = audio  # (1, audio_samples)
+        copy_dict['pad_bytes'] = padded_audio.nbytes
 
         # Enframe to segments
-        segments = self.enframe(audio, self.segment_samples)
+        segments = self.enframe(padded_audio, self.segment_samples, 
+            self.hop_samples)
         """(N, segment_samples)"""
 
+        # Skip silent segments
+        if self.silence_threshold is None:
+            segment_indexes = None
+        else:
+            silent = self.get_silent_segments(padded_audio, len(segments))
+            silent[0] = False   # Forward at least one segment to get the outputs
+            segment_indexes = np.nonzero(~silent)[0]
+
         # Forward
-        output_dict = forward(self.model, segments, batch_size=1)
+        batch_size = self.get_batch_size(batch_size)
+        forward_time = time.time()
+
+        if self.feature_store is None:
+            output_dict = forward(self.model, segments, batch_size=batch_size, 
+                pin_memory=self.pin_memory, copy_dict=copy_dict, 
+                segment_indexes=segment_indexes, device=self.device, 
+                output_dtypes=self.output_dtypes)
+        else:
+            logmel = self.get_logmel(segments, audio_sha256, batch_size)
+            output_dict = forward(self.logmel_model, logmel, 
+                batch_size=batch_size, pin_memory=self.pin_memory, 
+                copy_dict=copy_dict, segment_indexes=segment_indexes, 
+                device=self.device, output_dtypes=self.output_dtypes)
         """{'reg_onset_output': (N, segment_frames, classes_num), ...}"""
+        forward_time = time.time() - forward_time
+
+        if segment_indexes is None:
+            silence_dict = None
+        else:
+            skipped_num = len(segments) - len(segment_indexes)
+            silence_dict = {
+                'skipped_segments': skipped_num, 
+                'segments': len(segments), 
+                'saved_seconds': forward_time / len(segment_indexes) * skipped_num}
+            print('Skipped {} / {} silent segments, saved about {:.1f} s'.format(
+                skipped_num, len(segments), silence_dict['saved_seconds']))
+
+        transcribed_dict = self.output_dict_to_transcribed_dict(output_dict, 
+            audio_len, midi_path, copy_dict, cache_key=cache_key)
+        transcribed_dict['silence_dict'] = silence_dict
+        transcribed_dict['cache_hit'] = False
+
+        return transcribed_dict
+
+    def get_logmel(self, segments, audio_sha256, batch_size):
+        """Log mel features of the segments of an audio, from the feature 
+        store or extracted and stored.
+
+        Args:
+          segments: (N, segment_samples)
+          audio_sha256: str
+          batch_size: int
+
+        Returns:
+          logmel: (N, 1, segment_frames, mel_bins), memory-mapped if stored
+        """
+        key = get_cache_key(audio_sha256, None, self.feature_settings)
+        feature_dict = self.feature_store.get(key)
+
+        if feature_dict is None:
+            # Every segment, also silent ones, so that the features do not 
+            # depend on silence skipping
+            feature_dict = forward(self.logmel_extractor, segments, 
+                batch_size=batch_size, pin_memory=self.pin_memory, 
+                device=self.device)
+            self.feature_store.put(key, feature_dict)
+        else:
+            print('Using stored features {}'.format(key))
+
+        return feature_dict['logmel']
+
+    def transcribe_many(self, audios, midi_paths=None, batch_size=None):
+        """Transcribe many audio recordings, forwarding segments of different
+        recordings in the same mini-batches. Short recordings then fill the
+        batches instead of each running a small batch of its own. Results 
+        are the same as transcribe() on each recording, which also reads and
+        writes the output cache and the feature store.
+
+        Args:
+          audios: list of (audio_samples,)
+          midi_paths: None | list of None | str
+          batch_size: None | int | 'auto', overrides self.batch_size
 
+        Returns:
+          transcribed_dicts: list of transcribed_dict of transcribe()
+        """
+        if len(audios) == 0:
+            return []
+
+        if midi_paths is None:
+            midi_paths = [None] * len(audios)
+
+        if self.output_cache is None and self.feature_store is None:
+            audio_sha256s = [None] * len(audios)
+        else:
+            audio_sha256s = [get_audio_sha256(audio) for audio in audios]
+
+        transcribed_dicts = [None] * len(audios)
+        cache_keys = [None] * len(audios)
+
+        # Cached outputs only need the post processing
+        if self.output_cache is not None:
+            for n in range(len(audios)):
+                cache_keys[n] = get_cache_key(audio_sha256s[n], 
+                    self.model_sha256, self.cache_settings)
+                output_dict = self.output_cache.get(cache_keys[n])
+
+                if output_dict is not None:
+                    print('Using cached outputs {}'.format(cache_keys[n]))
+                    transcribed_dict = self.postprocess(output_dict, midi_paths[n])
+                    transcribed_dict['copy_dict'] = {}
+                    transcribed_dict['silence_dict'] = None
+                    transcribed_dict['cache_hit'] = True
+                    transcribed_dicts[n] = transcribed_dict
+
+        # Recordings to forward
+        misses = [n for n in range(len(audios)) if transcribed_dicts[n] is None]
+        if len(misses) == 0:
+            return transcribed_dicts
+
+        audios = [audios[n] for n in misses]
+
+        # Put the padded audios one after another, each starting at a 
+        # multiple of hop_samples so that one strided view enframes all
+        audio_lens = [audio.shape[0] for audio in audios]
+        padded_lens = [self.get_padded_len(audio_len) for audio_len in audio_lens]
+        segment_nums = [(padded_len - self.segment_samples) // self.hop_samples + 1 
+            for padded_len in padded_lens]
+        hops_nums = [-(-padded_len // self.hop_samples) for padded_len in padded_lens]
+        first_segments = np.concatenate(([0], np.cumsum(hops_nums)[: -1]))
+
+        total_len = (first_segments[-1] + segment_nums[-1] - 1) * self.hop_samples \
+            + self.segment_samples
+        padded_audio = np.zeros((1, total_len), dtype=np.float32)
+
+        segment_indexes = []
+        silent_nums = []
+
+        for n, audio in enumerate(audios):
+            bgn = first_segments[n] * self.hop_samples
+            padded_audio[0, bgn : bgn + audio_lens[n]] = audio
+            indexes = np.arange(first_segments[n], first_segments[n] + segment_nums[n])
+
+            if self.silence_threshold is not None:
+                silent = self.get_silent_segments(
+                    padded_audio[:, bgn : bgn + padded_lens[n]], segment_nums[n])
+                silent[0] = False
+                indexes = indexes[~silent]
+                silent_nums.append(int(np.sum(silent)))
+
+            segment_indexes.append(indexes)
+
+        segments = self.enframe(padded_audio, self.segment_samples, 
+            self.hop_samples)
+        segment_indexes = np.concatenate(segment_indexes)
+
+        # Forward
+        batch_size = self.get_batch_size(batch_size)
+        forward_time = time.time()
+
+        if self.feature_store is None:
+            all_output_dict = forward(self.model, segments, batch_size=batch_size, 
+                pin_memory=self.pin_memory, segment_indexes=segment_indexes, 
+                device=self.device, output_dtypes=self.output_dtypes)
+        else:
+            # Features of each recording, from the store or extracted and 
+            # stored, at the positions of its segments
+            logmel = None
+            for n in range(len(audios)):
+                indexes = slice(first_segments[n], first_segments[n] + segment_nums[n])
+                audio_logmel = self.get_logmel(segments[indexes], 
+                    audio_sha256s[misses[n]], batch_size)
+                if logmel is None:
+                    logmel = np.zeros((len(segments),) + audio_logmel.shape[1 :], 
+                        dtype=audio_logmel.dtype)
+                logmel[indexes] = audio_logmel
+
+            all_output_dict = forward(self.logmel_model, logmel, 
+                batch_size=batch_size, pin_memory=self.pin_memory, 
+                segment_indexes=segment_indexes, device=self.device, 
+                output_dtypes=self.output_dtypes)
+
+        forward_time = time.time() - forward_time
+
+        # Split the outputs back to recordings
+        for n in range(len(audios)):
+            output_dict = {key: all_output_dict[key][first_segments[n] : 
+                first_segments[n] + segment_nums[n]] for key in all_output_dict.keys()}
+            copy_dict = {'pad_bytes': padded_lens[n] * padded_audio.itemsize}
+
+            transcribed_dict = self.output_dict_to_transcribed_dict(output_dict, 
+                audio_lens[n], midi_paths[misses[n]], copy_dict, 
+                cache_key=cache_keys[misses[n]])
+
+            if self.silence_threshold is None:
+                transcribed_dict['silence_dict'] = None
+            else:
+                transcribed_dict['silence_dict'] = {
+                    'skipped_segments': silent_nums[n], 
+                    'segments': segment_nums[n], 
+                    'saved_seconds': forward_time / len(segment_indexes) * silent_nums[n]}
+
+            transcribed_dict['cache_hit'] = False
+            transcribed_dicts[misses[n]] = transcribed_dict
+
+        return transcribed_dicts
+
+    def output_dict_to_transcribed_dict(self, output_dict, audio_len, midi_path, 
+        copy_dict, cache_key=None):
+        """Deframe forwarded segments of a recording, post process them to 
+        MIDI events and write the events to midi_path.
+
+        Args:
+          output_dict: {'reg_onset_output': (N, segment_frames, classes_num), ...}
+          audio_len: int
+          midi_path: None | str
+          copy_dict: dict, bytes copied so far
+          cache_key: None | str, save the deframed outputs in the cache
+
+        Returns:
+          transcribed_dict: dict, {'output_dict':, ..., 'est_note_events': ...,
+            'est_pedal_events': ..., 'copy_dict': ...}
+        """
         # Deframe to original length
+        copy_dict['deframe_bytes'] = 0
         for key in output_dict.keys():
-            output_dict[key] = self.deframe(output_dict[key])[0 : audio_len]
+            output_dict[key] = self.deframe(output_dict[key])
+            if output_dict[key].base is None:
+                copy_dict['deframe_bytes'] += output_dict[key].nbytes
+            output_dict[key] = output_dict[key][0 : audio_len]
+
+        print('Copied {:.1f} MB: {}'.format(sum(copy_dict.values()) / 1e6, 
+            ', '.join('{} {:.1f} MB'.format(key, copy_dict[key] / 1e6) 
+            for key in copy_dict.keys())))
         """output_dict: {
           'reg_onset_output': (N, segment_frames, classes_num), 
           'reg_offset_output': (N, segment_frames, classes_num), 
           'frame_output': (N, segment_frames, classes_num), 
           'velocity_output': (N, segment_frames, classes_num)}"""
 
+        if cache_key is not None:
+            self.output_cache.put(cache_key, output_dict)
+
+        transcribed_dict = self.postprocess(output_dict, midi_path)
+        transcribed_dict['copy_dict'] = copy_dict
+
+        return transcribed_dict
+
+    def postprocess(self, output_dict, midi_path):
+        """Post process deframed outputs to MIDI events and write the events
+        to midi_path.
+
+        Args:
+          output_dict: {'reg_onset_output': (frames_num, classes_num), ...}
+          midi_path: None | str
+
+        Returns:
+          transcribed_dict: dict, {'output_dict':, ..., 'est_note_events': ...,
+            'est_pedal_events': ...}
+        """
         # Post processor
         post_processor = RegressionPostProcessor(self.frames_per_second, 
             classes_num=self.classes_num, onset_threshold=self.onset_threshold, 
             offset_threshold=self.offset_threshod, 
             frame_threshold=self.frame_threshold, 
-            pedal_offset_threshold=self.pedal_offset_threshold)
+            pedal_offset_threshold=self.pedal_offset_threshold, 
+            velocity_table=self.velocity_table)
 
         # Post process output_dict to MIDI events
         (est_note_events, est_pedal_events) = \
-            post_processor.output_dict_to_midi_events(output_dict)
+            post_processor.output_dict_to_midi_events(output_dict, 
+                tables=self.tables)
 
         # Write MIDI events to file
         if midi_path:
@@ -122,27 +549,183 @@ class PianoTranscription(object):
 
         return transcribed_dict
 
-    def enframe(self, x, segment_samples):
-        """Enframe long sequence to short segments.
+    def transcribe_stream(self, chunks, batch_size=None):
+        """Transcribe an audio stream block by block. Segments are forwarded as
+        soon as they are complete, and note and pedal events are yielded as 
+        soon as they are closed. All yielded events together are the same as 
+        the events of transcribe() on the concatenated audio.
+
+        Args:
+          chunks: iterable of (chunk_samples,)
+          batch_size: None | int | 'auto', overrides self.batch_size
+
+        Yields:
+          events_dict, dict: {'est_note_events': ..., 'est_pedal_events': ...}
+        """
+        batch_size = self.get_batch_size(batch_size)
+
+        post_processor = StreamingRegressionPostProcessor(self.frames_per_second, 
+            classes_num=self.classes_num, onset_threshold=self.onset_threshold, 
+            offset_threshold=self.offset_threshod, 
+            frame_threshold=self.frame_threshold, 
+            pedal_offset_threshold=self.pedal_offset_threshold, 
+            velocity_table=self.velocity_table)
+
+        segments_num = 0
+        tail_dict = {}
+
+        for (segments, final) in self.enframe_stream(chunks, 
+            self.segment_samples, self.hop_samples):
+            output_dict = {}
+
+            if len(segments) > 0:
+                segments_output_dict = forward(self.model, segments, 
+                    batch_size=batch_size, pin_memory=self.pin_memory, 
+                    device=self.device, output_dtypes=self.output_dtypes)
+
+                for key in segments_output_dict.keys():
+                    (output_dict[key], tail_dict[key]) = self.deframe_stream(
+                        segments_output_dict[key], is_first=(segments_num == 0))
+
+                segments_num += len(segments)
+
+            if final:
+                for key in tail_dict.keys():
+                    tail = tail_dict[key] if segments_num == 1 else tail_dict[key][0 : -1]
+                    """Remove the extra frame of the last segment, the same as 
+                    deframe()"""
+                    output_dict[key] = np.concatenate((output_dict[key], tail), 
+                        axis=0) if key in output_dict.keys() else tail
+
+            if not output_dict:
+                continue
+
+            (est_note_events, est_pedal_events) = \
+                post_processor.update(output_dict, final=final)
+
+            if est_note_events or est_pedal_events:
+                yield {
+                    'est_note_events': est_note_events, 
+                    'est_pedal_events': est_pedal_events}
+
+    def export(self, script_path):
+        """Fold the BatchNorms of the model and export it as a frozen 
+        TorchScript model for inference, loaded with 
+        PianoTranscription(script_path=script_path). A copy of the model is
+        folded, the model of this object is not changed. Models with 
+        precision='int8' cannot be exported.
+
+        Args:
+          script_path: str
+
+        Returns:
+          diff_dict: dict, largest absolute difference of each output between
+            the exported and the eager model
+        """
+        model = self.model.module if isinstance(self.model, 
+            torch.nn.DataParallel) else self.model
+        return export_for_inference(model, self.segment_samples, script_path)
+
+    def get_batch_size(self, batch_size=None):
+        """Resolve the batch size used to forward segments.
+
+        Args:
+          batch_size: None | int | 'auto'
+
+        Returns:
+          batch_size: int
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+
+        if batch_size == 'auto':
+            batch_size = get_auto_batch_size(self.segment_samples, 
+                self.memory_budget)
+            print('Auto batch size: {}'.format(batch_size))
+
+        return batch_size
+
+    def get_padded_len(self, audio_len):
+        """Length of audio padded for the last segment. Segments start every 
+        hop_samples and the last one is the first to reach the end of the 
+        audio, so less than one hop of zeros is forwarded.
+
+        Args:
+          audio_len: int
+
+        Returns:
+          padded_len: int
+        """
+        segments_num = 1 + max(int(np.ceil(
+            (audio_len - self.segment_samples) / self.hop_samples)), 0)
+        return self.segment_samples + (segments_num - 1) * self.hop_samples
+
+    def get_silent_segments(self, x, segments_num):
+        """Find segments whose audio, extended by silence_guard_seconds on 
+        both sides, has no frame louder than silence_threshold. The guard 
+        keeps segments with note tails or onsets close to their borders.
+
+        Args:
+          x: (1, audio_samples), padded audio
+          segments_num: int
+
+        Returns:
+          silent: (segments_num,), bool
+        """
+        hop_size = config.sample_rate // self.frames_per_second
+        frames = x[0, 0 : x.shape[1] // hop_size * hop_size].reshape(-1, hop_size)
+        energy = np.mean(np.square(frames, dtype=np.float64), axis=1)
+        loud = 10. * np.log10(energy + 1e-20) >= self.silence_threshold
+
+        # Number of loud frames before each frame
+        loud_cumsum = np.concatenate(([0], np.cumsum(loud)))
+
+        guard = int(self.silence_guard_seconds * self.frames_per_second)
+        bgns = np.arange(segments_num) * (self.hop_samples // hop_size) - guard
+        fins = bgns + self.segment_samples // hop_size + 2 * guard
+        bgns = np.clip(bgns, 0, len(loud))
+        fins = np.clip(fins, 0, len(loud))
+
+        return loud_cumsum[fins] - loud_cumsum[bgns] == 0
+
+    def enframe(self, x, segment_samples, hop_samples=None):
+        """Enframe long sequence to short segments. The segments are a read-only
+        strided view of x, so no audio is copied.
 
         Args:
           x: (1, audio_samples)
           segment_samples: int
+          hop_samples: None | int, default segment_samples // 2
 
         Returns:
           batch: (N, segment_samples)
         """
-        assert x.shape[1] % segment_samples == 0
-        batch = []
+        if hop_samples is None:
+            hop_samples = segment_samples // 2
 
-        pointer = 0
-        while pointer + segment_samples <= x.shape[1]:
-            batch.append(x[:, pointer : pointer + segment_samples])
-            pointer += segment_samples // 2
+        assert (x.shape[1] - segment_samples) % hop_samples == 0
+        segments_num = (x.shape[1] - segment_samples) // hop_samples + 1
 
-        batch = np.concatenate(batch, axis=0)
+        x = np.ascontiguousarray(x[0])
+        batch = np.lib.stride_tricks.as_strided(x, 
+            shape=(segments_num, segment_samples), 
+            strides=(hop_samples * x.strides[0], x.strides[0]), writeable=False)
         return batch
 
+    def get_kept_frames(self, segment_frames):
+        """Frames of a segment kept when deframing. The overlapped frames are
+        split evenly between neighbouring segments.
+
+        Args:
+          segment_frames: int, without the extra frame
+
+        Returns:
+          (bgn, fin): int, the kept frames of a middle segment are [bgn, fin)
+        """
+        hop_frames = segment_frames * self.hop_samples // self.segment_samples
+        bgn = (segment_frames - hop_frames) // 2
+        return bgn, segment_frames - bgn
+
     def deframe(self, x):
         """Deframe predicted segments to original sequence.
 
@@ -160,12 +743,75 @@ class PianoTranscription(object):
             """Remove an extra frame in the end of each segment caused by the
             'center=True' argument when calculating spectrogram."""
             (N, segment_samples, classes_num) = x.shape
-            assert segment_samples % 4 == 0
-
-            y = []
-            y.append(x[0, 0 : int(segment_samples * 0.75)])
-            for i in range(1, N - 1):
-                y.append(x[i, int(segment_samples * 0.25) : int(segment_samples * 0.75)])
-            y.append(x[-1, int(segment_samples * 0.25) :])
-            y = np.concatenate(y, axis=0)
-            return y
\ No newline at end of file
+            (bgn, fin) = self.get_kept_frames(segment_samples)
+            middle_len = (N - 2) * (fin - bgn)
+
+            # Write the segments directly into the preallocated output
+            y = np.empty((fin + middle_len + segment_samples - bgn, classes_num), 
+                dtype=x.dtype)
+            y[0 : fin] = x[0, 0 : fin]
+            y[fin : fin + middle_len].reshape(N - 2, fin - bgn, classes_num)[:] = \
+                x[1 : N - 1, bgn : fin]
+            y[fin + middle_len :] = x[-1, bgn :]
+            return y
+
+    def enframe_stream(self, chunks, segment_samples, hop_samples):
+        """Enframe an audio stream to segments. The segments are the same as 
+        enframe() returns for the concatenated audio padded to 
+        get_padded_len().
+
+        Args:
+          chunks: iterable of (chunk_samples,)
+          segment_samples: int
+          hop_samples: int
+
+        Yields:
+          (batch, final): (N, segment_samples) of the segments completed by a 
+            chunk, and whether the stream has ended
+        """
+        buffer = np.zeros(0, dtype=np.float32)
+        """Audio from the start of the next segment"""
+        audio_len = 0
+
+        def _pop_segments(buffer):
+            segments_num = max((len(buffer) - segment_samples) // hop_samples + 1, 0)
+            batch = np.zeros((segments_num, segment_samples), dtype=buffer.dtype)
+            for i in range(segments_num):
+                batch[i] = buffer[i * hop_samples : i * hop_samples + segment_samples]
+            return batch, buffer[segments_num * hop_samples :]
+
+        for chunk in chunks:
+            audio_len += len(chunk)
+            buffer = np.concatenate((buffer, np.asarray(chunk, dtype=np.float32)))
+            (batch, buffer) = _pop_segments(buffer)
+            if len(batch) > 0:
+                yield batch, False
+
+        # Pad audio to fit the last segment
+        pad_len = self.get_padded_len(audio_len) - audio_len
+        buffer = np.concatenate((buffer, np.zeros(pad_len, dtype=buffer.dtype)))
+        (batch, buffer) = _pop_segments(buffer)
+        yield batch, True
+
+    def deframe_stream(self, x, is_first):
+        """Deframe the next predicted segments of a stream.
+
+        Args:
+          x: (N, segment_frames, classes_num)
+          is_first: bool, whether x starts with the first segment
+
+        Returns:
+          y: (frames, classes_num), the frames that no later segment overlaps
+          tail: (tail_frames, classes_num), the rest of the last segment, used
+            if no segment follows
+        """
+        segment_samples = x.shape[1] - 1
+        """Without the extra frame caused by the 'center=True' argument when 
+        calculating spectrogram."""
+        (bgn, fin) = self.get_kept_frames(segment_samples)
+
+        y = []
+        for i in range(x.shape[0]):
+            y.append(x[i, 0 if (is_first and i == 0) else bgn : fin])
+        y = np.concatenate(y, axis=0)
+        return y, x[-1, fin :]
@@ -0,0 +1,124 @@
+import os
+import sys
+import time
+import resource
+import argparse
+import tempfile
+from typing import Dict
+
+import numpy as np
+import torch
+
+from .inference import PianoTranscription
+from . import config
+
+
+class StubModel(torch.nn.Module):
+    def __init__(self, segment_samples, classes_num=config.classes_num):
+        """Model with the outputs of Note_pedal and no computation, so that
+        the memory of the inference around the model can be measured on long
+        audio. Every segment gets the same outputs, a note on a few keys
+        every 0.5 s.
+
+        Args:
+          segment_samples: int
+          classes_num: int
+        """
+        super(StubModel, self).__init__()
+
+        hop_size = config.sample_rate // config.frames_per_second
+        frames_num = segment_samples // hop_size + 1
+
+        # Triangles of onsets regressed by the model
+        distances = np.abs(np.arange(frames_num) % 50 - 25)
+        reg_onset_output = np.zeros((frames_num, classes_num), dtype=np.float32)
+        reg_onset_output[:, 0 : classes_num : 11] = np.clip(
+            1 - distances / 5, 0, 1)[:, None]
+
+        self.register_buffer('reg_onset_output', torch.Tensor(reg_onset_output))
+        self.register_buffer('note_output',
+            torch.full((frames_num, classes_num), 0.5))
+        self.register_buffer('pedal_output', torch.zeros(frames_num, 1))
+
+    def forward(self, input: torch.Tensor) -> Dict[str, torch.Tensor]:
+        batch_size = input.shape[0]
+        note_zeros = torch.zeros_like(self.note_output)
+
+        return {'reg_onset_output': self.reg_onset_output.repeat(batch_size, 1, 1),
+            'reg_offset_output': note_zeros.repeat(batch_size, 1, 1),
+            'frame_output': self.note_output.repeat(batch_size, 1, 1),
+            'velocity_output': self.note_output.repeat(batch_size, 1, 1),
+            'reg_pedal_onset_output': self.pedal_output.repeat(batch_size, 1, 1),
+            'reg_pedal_offset_output': self.pedal_output.repeat(batch_size, 1, 1),
+            'pedal_frame_output': self.pedal_output.repeat(batch_size, 1, 1)}
+
+
+def get_peak_rss():
+    """Peak resident memory of this process in bytes."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def get_memory_report(seconds=3600., segment_samples=16000*10, batch_size=8,
+    **kwargs):
+    """Peak memory of PianoTranscription.transcribe() on long audio, with a
+    stub model in place of Note_pedal. Only the memory of padding,
+    enframing, forwarding, deframing and post processing is measured, which
+    grows with the audio.
+
+    Peak resident memory never decreases, so run one report per process.
+
+    Args:
+      seconds: float, duration of the audio
+      segment_samples: int
+      batch_size: int
+      kwargs: arguments of PianoTranscription, e.g. overlap, precision
+
+    Returns:
+      report: dict, {'peak_bytes': ..., 'seconds': ..., 'copy_dict': ...},
+        where peak_bytes is the peak resident memory of transcribe() above
+        the peak before it
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        script_path = os.path.join(tmp_dir, 'stub.pt')
+        torch.jit.script(StubModel(segment_samples)).save(script_path)
+
+        transcriptor = PianoTranscription(script_path=script_path,
+            segment_samples=segment_samples, device='cpu',
+            batch_size=batch_size, **kwargs)
+
+    # Quiet noise, written in chunks so that no temporary array raises the
+    # peak before the transcription
+    random_state = np.random.RandomState(1234)
+    audio = np.empty(int(seconds * config.sample_rate), dtype=np.float32)
+    for bgn in range(0, len(audio), config.sample_rate * 60):
+        chunk = audio[bgn : bgn + config.sample_rate * 60]
+        chunk[:] = random_state.uniform(-0.01, 0.01, len(chunk))
+
+    peak_before = get_peak_rss()
+    start_time = time.time()
+    transcribed_dict = transcriptor.transcribe(audio, None)
+
+    report = {'peak_bytes': get_peak_rss() - peak_before,
+        'seconds': time.time() - start_time,
+        'copy_dict': transcribed_dict['copy_dict']}
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Peak memory of transcribing '
+        'long audio with a stub model.')
+    parser.add_argument('--seconds', type=float, default=3600.)
+    parser.add_argument('--segment_samples', type=int, default=16000*10)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--overlap', type=float, default=0.5)
+    parser.add_argument('--precision', type=str, default='fp32')
+    args = parser.parse_args()
+
+    report = get_memory_report(seconds=args.seconds,
+        segment_samples=args.segment_samples, batch_size=args.batch_size,
+        overlap=args.overlap, precision=args.precision)
+
+    print('{:.0f} s of audio: peak memory +{:.0f} MB, {:.1f} s'.format(
+        args.seconds, report['peak_bytes'] / 1e6, report['seconds']))
@@ -28,6 +28,18 @@ def init_bn(bn):
     bn.weight.data.fill_(1.)
 
 
+def fold_bn(layer, bn):
+    """Fold an inference mode BatchNorm following a Conv2d or Linear layer 
+    into the weight and bias of the layer."""
+    with torch.no_grad():
+        scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+        shape = (-1,) + (1,) * (layer.weight.dim() - 1)
+        bias = -bn.running_mean if layer.bias is None else \
+            layer.bias - bn.running_mean
+        layer.weight = nn.Parameter(layer.weight * scale.view(shape))
+        layer.bias = nn.Parameter(bias * scale + bn.bias)
+
+ 
 def init_gru(rnn):
     """Initialize a GRU layer. """
     
@@ -82,6 +94,11 @@ class ConvBlock(nn.Module):
         init_bn(self.bn1)
         init_bn(self.bn2)
 
+    def fold_bn(self):
+        fold_bn(self.conv1, self.bn1)
+        fold_bn(self.conv2, self.bn2)
+        self.bn1 = nn.Identity()
+        self.bn2 = nn.Identity()
         
     def forward(self, input, pool_size=(2, 2), pool_type='avg'):
         """
@@ -116,6 +133,9 @@ class AcousticModelCRnn8Dropout(nn.Module):
             bias=True, batch_first=True, dropout=0., bidirectional=True)
 
         self.fc = nn.Linear(512, classes_num, bias=True)
+
+        self.conv_dtype = None
+        """None | torch.dtype, autocast dtype of the conv blocks"""
         
         self.init_weight()
 
@@ -125,6 +145,10 @@ class AcousticModelCRnn8Dropout(nn.Module):
         init_gru(self.gru)
         init_layer(self.fc)
 
+    def fold_bn(self):
+        fold_bn(self.fc5, self.bn5)
+        self.bn5 = nn.Identity()
+
     def forward(self, input):
         """
         Args:
@@ -133,16 +157,22 @@ class AcousticModelCRnn8Dropout(nn.Module):
           output: (batch_size, time_steps, classes_num)
         """
 
-        x = self.conv_block1(input, pool_size=(1, 2), pool_type='avg')
-        x = F.dropout(x, p=0.2, training=self.training)
-        x = self.conv_block2(x, pool_size=(1, 2), pool_type='avg')
-        x = F.dropout(x, p=0.2, training=self.training)
-        x = self.conv_block3(x, pool_size=(1, 2), pool_type='avg')
-        x = F.dropout(x, p=0.2, training=self.training)
-        x = self.conv_block4(x, pool_size=(1, 2), pool_type='avg')
-        x = F.dropout(x, p=0.2, training=self.training)
-
-        x = x.transpose(1, 2).flatten(2)
+        # Only the conv blocks, which take most of the computation, may run 
+        # in reduced precision. Onsets and offsets are picked from small
+        # differences between frames, which bfloat16 outputs cannot resolve.
+        with torch.autocast(device_type=input.device.type, 
+            dtype=self.conv_dtype or torch.bfloat16, 
+            enabled=self.conv_dtype is not None):
+            x = self.conv_block1(input, pool_size=(1, 2), pool_type='avg')
+            x = F.dropout(x, p=0.2, training=self.training)
+            x = self.conv_block2(x, pool_size=(1, 2), pool_type='avg')
+            x = F.dropout(x, p=0.2, training=self.training)
+            x = self.conv_block3(x, pool_size=(1, 2), pool_type='avg')
+            x = F.dropout(x, p=0.2, training=self.training)
+            x = self.conv_block4(x, pool_size=(1, 2), pool_type='avg')
+            x = F.dropout(x, p=0.2, training=self.training)
+
+        x = x.float().transpose(1, 2).flatten(2)
         x = F.relu(self.bn5(self.fc5(x).transpose(1, 2)).transpose(1, 2))
         x = F.dropout(x, p=0.5, training=self.training, inplace=False)
         
@@ -173,6 +203,14 @@ class Regress_onset_offset_frame_velocity_CRNN(nn.Module):
         midfeat = 1792
         momentum = 0.01
 
+        self.front_end_dict = {'sample_rate': sample_rate, 
+            'window_size': window_size, 'hop_size': hop_size, 
+            'mel_bins': mel_bins, 'fmin': fmin, 'fmax': fmax, 'window': window, 
+            'center': center, 'pad_mode': pad_mode, 'ref': ref, 'amin': amin, 
+            'top_db': top_db}
+        """Parameters of the log mel front-end, models with the same parameters
+        extract the same features"""
+
         # Spectrogram extractor
         self.spectrogram_extractor = Spectrogram(n_fft=window_size, 
             hop_length=hop_size, win_length=window_size, window=window, 
@@ -219,10 +257,26 @@ class Regress_onset_offset_frame_velocity_CRNN(nn.Module):
             'velocity_output': (batch_size, time_steps, classes_num)
           }
         """
+        return self.forward_logmel(self.extract_logmel(input))
 
+    def extract_logmel(self, input):
+        """
+        Args:
+          input: (batch_size, data_length)
+        Outputs:
+          x: (batch_size, 1, time_steps, mel_bins)
+        """
         x = self.spectrogram_extractor(input)   # (batch_size, 1, time_steps, freq_bins)
         x = self.logmel_extractor(x)    # (batch_size, 1, time_steps, mel_bins)
+        return x
 
+    def forward_logmel(self, x):
+        """
+        Args:
+          x: (batch_size, 1, time_steps, mel_bins)
+        Outputs:
+          output_dict: dict, same as forward()
+        """
         x = x.transpose(1, 3)
         x = self.bn0(x)
         x = x.transpose(1, 3)
@@ -276,6 +330,14 @@ class Regress_pedal_CRNN(nn.Module):
         midfeat = 1792
         momentum = 0.01
 
+        self.front_end_dict = {'sample_rate': sample_rate, 
+            'window_size': window_size, 'hop_size': hop_size, 
+            'mel_bins': mel_bins, 'fmin': fmin, 'fmax': fmax, 'window': window, 
+            'center': center, 'pad_mode': pad_mode, 'ref': ref, 'amin': amin, 
+            'top_db': top_db}
+        """Parameters of the log mel front-end, models with the same parameters
+        extract the same features"""
+
         # Spectrogram extractor
         self.spectrogram_extractor = Spectrogram(n_fft=window_size, 
             hop_length=hop_size, win_length=window_size, window=window, 
@@ -309,45 +371,131 @@ class Regress_pedal_CRNN(nn.Module):
             'velocity_output': (batch_size, time_steps, classes_num)
           }
         """
+        return self.forward_logmel(self.extract_logmel(input))
 
+    def extract_logmel(self, input):
+        """
+        Args:
+          input: (batch_size, data_length)
+        Outputs:
+          x: (batch_size, 1, time_steps, mel_bins)
+        """
         x = self.spectrogram_extractor(input)   # (batch_size, 1, time_steps, freq_bins)
         x = self.logmel_extractor(x)    # (batch_size, 1, time_steps, mel_bins)
+        return x
 
+    def forward_logmel(self, x, pedal_onset=True):
+        """
+        Args:
+          x: (batch_size, 1, time_steps, mel_bins)
+          pedal_onset: bool, False to skip the pedal onset head
+        Outputs:
+          output_dict: dict, same as forward()
+        """
         x = x.transpose(1, 3)
         x = self.bn0(x)
         x = x.transpose(1, 3)
 
-        reg_pedal_onset_output = self.reg_pedal_onset_model(x)  # (batch_size, time_steps, classes_num)
-        reg_pedal_offset_output = self.reg_pedal_offset_model(x)  # (batch_size, time_steps, classes_num)
-        pedal_frame_output = self.reg_pedal_frame_model(x)  # (batch_size, time_steps, classes_num)
-        
-        output_dict = {
-            'reg_pedal_onset_output': reg_pedal_onset_output, 
-            'reg_pedal_offset_output': reg_pedal_offset_output,
-            'pedal_frame_output': pedal_frame_output}
+        output_dict = {}
+
+        if pedal_onset:
+            output_dict['reg_pedal_onset_output'] = self.reg_pedal_onset_model(x)  # (batch_size, time_steps, classes_num)
+
+        output_dict['reg_pedal_offset_output'] = self.reg_pedal_offset_model(x)  # (batch_size, time_steps, classes_num)
+        output_dict['pedal_frame_output'] = self.reg_pedal_frame_model(x)  # (batch_size, time_steps, classes_num)
 
         return output_dict
 
 
 # This model is not trained, but is combined from the trained note and pedal models.
 class Note_pedal(nn.Module):
-    def __init__(self, frames_per_second, classes_num):
+    def __init__(self, frames_per_second, classes_num, outputs='all'):
         """The combination of note and pedal model.
+
+        Args:
+          frames_per_second: int
+          classes_num: int
+          outputs: 'all' | 'notes_pedals' | 'notes', the heads to run. 
+            'notes_pedals' skips the pedal onset head, which is not used in 
+            inference, and 'notes' skips the pedal model.
         """
         super(Note_pedal, self).__init__()
 
+        assert outputs in ['all', 'notes_pedals', 'notes']
+        self.outputs = outputs
+
         self.note_model = Regress_onset_offset_frame_velocity_CRNN(frames_per_second, classes_num)
         self.pedal_model = Regress_pedal_CRNN(frames_per_second, classes_num)
 
-    def load_state_dict(self, m, strict=False):
-        self.note_model.load_state_dict(m['note_model'], strict=strict)
-        self.pedal_model.load_state_dict(m['pedal_model'], strict=strict)
+    def load_state_dict(self, m, strict=False, assign=False):
+        self.note_model.load_state_dict(m['note_model'], strict=strict, 
+            assign=assign)
+        self.pedal_model.load_state_dict(m['pedal_model'], strict=strict, 
+            assign=assign)
+
+    @property
+    def front_end_dict(self):
+        return self.note_model.front_end_dict
 
     def forward(self, input):
-        note_output_dict = self.note_model(input)
-        pedal_output_dict = self.pedal_model(input)
+        # The note and pedal models share the same front-end parameters, so 
+        # the log mel spectrogram is only calculated once. Each model still 
+        # applies its own bn0.
+        return self.forward_logmel(self.extract_logmel(input))
+
+    def extract_logmel(self, input):
+        return self.note_model.extract_logmel(input)
+
+    def forward_logmel(self, x):
+        note_output_dict = self.note_model.forward_logmel(x)
 
         full_output_dict = {}
         full_output_dict.update(note_output_dict)
-        full_output_dict.update(pedal_output_dict)
-        return full_output_dict
\ No newline at end of file
+
+        if self.outputs != 'notes':
+            pedal_output_dict = self.pedal_model.forward_logmel(x, 
+                pedal_onset=(self.outputs == 'all'))
+            full_output_dict.update(pedal_output_dict)
+
+        return full_output_dict
+
+
+class LogmelExtractor(nn.Module):
+    def __init__(self, model):
+        """Only the log mel front-end of model, e.g. to store features.
+
+        Args:
+          model: model with extract_logmel()
+        """
+        super(LogmelExtractor, self).__init__()
+        self.model = model
+
+    def forward(self, input):
+        """
+        Args:
+          input: (batch_size, data_length)
+        Outputs:
+          output_dict: dict, {'logmel': (batch_size, 1, time_steps, mel_bins)}
+        """
+        return {'logmel': self.model.extract_logmel(input)}
+
+
+class LogmelModel(nn.Module):
+    def __init__(self, model):
+        """Model forwarding log mel features instead of audio, skipping the 
+        front-end.
+
+        Args:
+          model: model with forward_logmel()
+        """
+        super(LogmelModel, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        """
+        Args:
+          x: (batch_size, 1, time_steps, mel_bins)
+        Outputs:
+          output_dict: dict, same as forward() of model
+        """
+        return self.model.forward_logmel(x)
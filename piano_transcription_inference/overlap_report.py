@@ -0,0 +1,46 @@
+from .drift_report import get_drift_report, get_report_parser, load_audios
+
+
+def get_overlap_report(audios, overlaps=(0.25, 0.1), ref_overlap=0.5, **kwargs):
+    """Compare smaller segment overlaps with ref_overlap on reference audio,
+    e.g. audio synthesized by 0_SYNTH.ipynb. The notes transcribed with
+    ref_overlap are the reference of the drift.
+
+    Args:
+      audios: list of (audio_samples,)
+      overlaps: sequence of float, overlaps of PianoTranscription to compare
+      ref_overlap: float
+      kwargs: arguments of PianoTranscription, e.g. checkpoint_path
+
+    Returns:
+      report: list of dict, one per overlap, the first is ref_overlap, e.g.
+        [{'overlap': 0.5, 'f1': 1., 'velocity_mae': 0., 'speed': ...,
+        'segments': ..., 'files': ...}, ...], see get_drift_report()
+    """
+    overlaps = [ref_overlap] + [overlap for overlap in overlaps
+        if overlap != ref_overlap]
+
+    report = get_drift_report(audios,
+        [{'overlap': overlap} for overlap in overlaps], **kwargs)
+
+    return [dict(result, overlap=overlap)
+        for (overlap, result) in zip(overlaps, report)]
+
+
+if __name__ == '__main__':
+    parser = get_report_parser('Note F1, velocity error and throughput of '
+        'segment overlaps against an overlap of 0.5.')
+    parser.add_argument('--overlaps', type=float, nargs='+', default=[0.25, 0.1])
+    parser.add_argument('--ref_overlap', type=float, default=0.5)
+    args = parser.parse_args()
+
+    report = get_overlap_report(load_audios(args.audio_paths),
+        overlaps=args.overlaps, ref_overlap=args.ref_overlap,
+        checkpoint_path=args.checkpoint_path)
+
+    print('| overlap | segments | note F1 | velocity MAE | speed |')
+    print('|---|---|---|---|---|')
+    for result in report:
+        print('| {:.2f} | {} | {:.4f} | {:.2f} | {:.2f}x real time |'.format(
+            result['overlap'], result['segments'], result['f1'],
+            result['velocity_mae'], result['speed']))
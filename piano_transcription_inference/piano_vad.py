@@ -1,3 +1,4 @@
+import bisect
 import numpy as np
 
 
@@ -23,57 +24,70 @@ def note_detection_with_onset_offset_regress(frame_output, onset_output,
         [1909, 1947, 0.30730522, -0.45764327, 0.64200014], 
         ...]
     """
+    frames_num = onset_output.shape[0]
+
+    # Every onset starts a note, except an onset in the first frame, which is
+    # never searched for an offset, and one in the last frame, which has no 
+    # frame left to end in.
+    onsets = np.nonzero(onset_output == 1)[0]
+    onsets = onsets[onsets > 0]
+    bgns = onsets[onsets < frames_num - 1]
+
+    if len(bgns) == 0:
+        return []
+
+    # A note ends at whichever comes first of: the next onset (consecutive 
+    # onsets), the first frame below frame_threshold, or 600 frames / the 
+    # last frame. Ties are resolved in that order.
+    next_onsets = _next_index(onsets, bgns, frames_num)
+    frame_disappears = _next_index(
+        np.nonzero(frame_output <= frame_threshold)[0], bgns, frames_num)
+    offset_occurs = _next_index(
+        np.nonzero(offset_output == 1)[0], bgns, frames_num)
+    caps = np.minimum(bgns + 600, frames_num - 1)
+
+    consecutive = next_onsets <= np.minimum(frame_disappears, caps)
+    disappear = ~consecutive & (frame_disappears <= caps)
+
+    fins = caps.copy()
+    fins[consecutive] = next_onsets[consecutive] - 1
+
+    """bgn --------- offset_occur --- frame_disappear uses the offset, 
+    bgn --- offset_occur --------- frame_disappear uses frame_disappear."""
+    use_offset = (offset_occurs <= frame_disappears) & \
+        (offset_occurs - bgns > frame_disappears - offset_occurs)
+    fins[disappear] = np.where(use_offset, offset_occurs, 
+        frame_disappears)[disappear]
+
     output_tuples = []
-    bgn = None
-    frame_disappear = None
-    offset_occur = None
-
-    for i in range(onset_output.shape[0]):
-        if onset_output[i] == 1:
-            """Onset detected"""
-            if bgn:
-                """Consecutive onsets. E.g., pedal is not released, but two 
-                consecutive notes being played."""
-                fin = max(i - 1, 0)
-                output_tuples.append([bgn, fin, onset_shift_output[bgn], 
-                    0, velocity_output[bgn]])
-                frame_disappear, offset_occur = None, None
-            bgn = i
-
-        if bgn and i > bgn:
-            """If onset found, then search offset"""
-            if frame_output[i] <= frame_threshold and not frame_disappear:
-                """Frame disappear detected"""
-                frame_disappear = i
-
-            if offset_output[i] == 1 and not offset_occur:
-                """Offset detected"""
-                offset_occur = i
-
-            if frame_disappear:
-                if offset_occur and offset_occur - bgn > frame_disappear - offset_occur:
-                    """bgn --------- offset_occur --- frame_disappear"""
-                    fin = offset_occur
-                else:
-                    """bgn --- offset_occur --------- frame_disappear"""
-                    fin = frame_disappear
-                output_tuples.append([bgn, fin, onset_shift_output[bgn], 
-                    offset_shift_output[fin], velocity_output[bgn]])
-                bgn, frame_disappear, offset_occur = None, None, None
-
-            if bgn and (i - bgn >= 600 or i == onset_output.shape[0] - 1):
-                """Offset not detected"""
-                fin = i
-                output_tuples.append([bgn, fin, onset_shift_output[bgn], 
-                    offset_shift_output[fin], velocity_output[bgn]])
-                bgn, frame_disappear, offset_occur = None, None, None
-
-    # Sort pairs by onsets
-    output_tuples.sort(key=lambda pair: pair[0])
+    for (bgn, fin, is_consecutive) in zip(bgns.tolist(), fins.tolist(), 
+        consecutive.tolist()):
+        offset_shift = 0 if is_consecutive else offset_shift_output[fin]
+        output_tuples.append([bgn, fin, onset_shift_output[bgn], 
+            offset_shift, velocity_output[bgn]])
 
     return output_tuples
 
 
+def _next_index(indexes, positions, default):
+    """For each position, find the first of the sorted indexes after it.
+
+    Args:
+      indexes: (indexes_num,), sorted
+      positions: (positions_num,)
+      default: int, returned for positions without a later index
+
+    Returns:
+      next_indexes: (positions_num,)
+    """
+    if len(indexes) == 0:
+        return np.full(len(positions), default)
+
+    pointers = np.searchsorted(indexes, positions, side='right')
+    next_indexes = indexes[np.minimum(pointers, len(indexes) - 1)]
+    return np.where(pointers < len(indexes), next_indexes, default)
+
+
 def pedal_detection_with_onset_offset_regress(frame_output, offset_output, 
     offset_shift_output, frame_threshold):
     """Process prediction array to pedal events information.
@@ -90,41 +104,41 @@ def pedal_detection_with_onset_offset_regress(frame_output, offset_output,
         [1909, 1947, 0.30730522, -0.45764327], 
         ...]
     """
+    frames_num = frame_output.shape[0]
+    never = frames_num + 10     # Later than any frame in the search
+
+    # Frames where the pedal rises above frame_threshold can start a pedal
+    rises = (np.nonzero((frame_output[1 :] >= frame_threshold) & 
+        (frame_output[1 :] > frame_output[: -1]))[0] + 1).tolist()
+    frame_disappears = np.nonzero(frame_output <= frame_threshold)[0].tolist()
+    offsets = np.nonzero(offset_output == 1)[0].tolist()
+
+    def _next(indexes, position):
+        k = bisect.bisect_right(indexes, position)
+        return indexes[k] if k < len(indexes) else never
+
     output_tuples = []
-    bgn = None
-    frame_disappear = None
-    offset_occur = None
-
-    for i in range(1, frame_output.shape[0]):
-        if frame_output[i] >= frame_threshold and frame_output[i] > frame_output[i - 1]:
-            """Pedal onset detected"""
-            if bgn:
-                pass
-            else:
-                bgn = i
-
-        if bgn and i > bgn:
-            """If onset found, then search offset"""
-            if frame_output[i] <= frame_threshold and not frame_disappear:
-                """Frame disappear detected"""
-                frame_disappear = i
-
-            if offset_output[i] == 1 and not offset_occur:
-                """Offset detected"""
-                offset_occur = i
-
-            if offset_occur:
-                fin = offset_occur
-                output_tuples.append([bgn, fin, 0., offset_shift_output[fin]])
-                bgn, frame_disappear, offset_occur = None, None, None
-
-            if frame_disappear and i - frame_disappear >= 10:
-                """offset not detected but frame disappear"""
-                fin = frame_disappear
-                output_tuples.append([bgn, fin, 0., offset_shift_output[fin]])
-                bgn, frame_disappear, offset_occur = None, None, None
-
-    # Sort pairs by onsets
-    output_tuples.sort(key=lambda pair: pair[0])
-
-    return output_tuples
\ No newline at end of file
+    pointer = 0
+
+    while True:
+        """Jump to the next pedal onset after the previous pedal is closed"""
+        bgn = _next(rises, pointer)
+        if bgn >= frames_num:
+            break
+
+        offset_occur = _next(offsets, bgn)
+        frame_disappear = _next(frame_disappears, bgn)
+
+        if offset_occur < frames_num and offset_occur <= frame_disappear + 10:
+            """Offset detected"""
+            fin = pointer = offset_occur
+        elif frame_disappear + 10 < frames_num:
+            """offset not detected but frame disappear"""
+            fin = frame_disappear
+            pointer = frame_disappear + 10
+        else:
+            break
+
+        output_tuples.append([bgn, fin, 0., offset_shift_output[fin]])
+
+    return output_tuples
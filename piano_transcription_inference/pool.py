@@ -0,0 +1,177 @@
+import os
+import time
+import argparse
+
+import torch
+import torch.multiprocessing as mp
+
+from .inference import PianoTranscription
+from .utilities import load_audio
+from . import config
+
+
+_worker_dict = {}
+"""State of a pool worker process: {'transcriptor': PianoTranscription}"""
+
+
+def _init_worker(transcriptor, threads_num, cpus, workers_num, workers_counter):
+    """Partition the CPUs between workers, so that workers do not compete for
+    the same cores. Each started worker takes the next block of threads_num
+    CPUs. Workers restarted by the pool wrap around to the first blocks."""
+    torch.set_num_threads(threads_num)
+
+    with workers_counter.get_lock():
+        n = workers_counter.value
+        workers_counter.value += 1
+
+    n %= workers_num
+    cpus = cpus[n * threads_num : (n + 1) * threads_num]
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+    _worker_dict['transcriptor'] = transcriptor
+
+
+def _transcribe_file(job):
+    (index, audio_path, midi_path) = job
+    start_time = time.time()
+
+    (audio, _) = load_audio(audio_path, sr=config.sample_rate, mono=True)
+    transcribed_dict = _worker_dict['transcriptor'].transcribe(audio, midi_path)
+
+    return {'index': index, 'audio_path': audio_path, 'midi_path': midi_path,
+        'est_note_events': transcribed_dict['est_note_events'],
+        'est_pedal_events': transcribed_dict['est_pedal_events'],
+        'seconds': time.time() - start_time}
+
+
+def transcribe_files(audio_paths, midi_paths=None, workers_num=None,
+    threads_num=None, transcriptor=None, **kwargs):
+    """Transcribe audio files with a pool of CPU worker processes.
+
+    The model is loaded once in this process and its weights are put in
+    shared memory, so workers do not hold copies of them. Each worker uses
+    threads_num torch threads pinned to its own CPUs. Files are handed out
+    longest first, with the file size as the length, so that a long file
+    does not start last and keep one worker busy after the others finished.
+
+    Args:
+      audio_paths: list of str
+      midi_paths: None | list of None | str
+      workers_num: None | int, default all CPUs // threads_num
+      threads_num: None | int, torch threads of each worker, default
+        all CPUs // workers_num
+      transcriptor: None | PianoTranscription on CPU, created with kwargs
+        if None
+      kwargs: arguments of PianoTranscription, e.g. checkpoint_path
+
+    Returns:
+      results: list of dict, {'est_note_events': ..., 'est_pedal_events': ...,
+        'seconds': ...} in the order of audio_paths
+      stats: dict, {'files_num': ..., 'seconds': ..., 'files_per_hour': ...}
+    """
+    if midi_paths is None:
+        midi_paths = [None] * len(audio_paths)
+
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') \
+        else list(range(os.cpu_count()))
+
+    if workers_num is None:
+        workers_num = max(len(cpus) // (threads_num or 1), 1)
+    if threads_num is None:
+        threads_num = max(len(cpus) // workers_num, 1)
+
+    if transcriptor is None:
+        transcriptor = PianoTranscription(device='cpu', **kwargs)
+    transcriptor.model.share_memory()
+
+    # Longest job first
+    jobs = sorted(zip(range(len(audio_paths)), audio_paths, midi_paths),
+        key=lambda job: os.path.getsize(job[1]), reverse=True)
+
+    # Fork shares the weights copy-on-write, spawn through shared memory
+    if 'fork' in mp.get_all_start_methods():
+        context = mp.get_context('fork')
+    else:
+        context = mp.get_context('spawn')
+
+    # Number of workers started, which gives each its CPUs
+    workers_counter = context.Value('i', 0)
+
+    start_time = time.time()
+    results = [None] * len(audio_paths)
+
+    with context.Pool(workers_num, initializer=_init_worker,
+        initargs=(transcriptor, threads_num, cpus, workers_num, 
+        workers_counter)) as pool:
+
+        for result in pool.imap_unordered(_transcribe_file, jobs, chunksize=1):
+            results[result['index']] = result
+            print('Transcribed {} in {:.1f} s'.format(result['audio_path'],
+                result['seconds']))
+
+    seconds = time.time() - start_time
+    stats = {'files_num': len(audio_paths), 'workers_num': workers_num,
+        'threads_num': threads_num, 'seconds': seconds,
+        'files_per_hour': len(audio_paths) / seconds * 3600}
+
+    return results, stats
+
+
+def get_scaling(audio_paths, max_workers_num=None, **kwargs):
+    """Files per hour of transcribe_files() with 1 to max_workers_num workers
+    of one thread each.
+
+    Args:
+      audio_paths: list of str
+      max_workers_num: None | int, default all CPUs
+      kwargs: arguments of PianoTranscription, e.g. checkpoint_path
+
+    Returns:
+      scaling: list of dict, {'workers_num': ..., 'files_per_hour': ...}
+    """
+    if max_workers_num is None:
+        max_workers_num = len(os.sched_getaffinity(0)) \
+            if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+
+    transcriptor = PianoTranscription(device='cpu', **kwargs)
+    scaling = []
+
+    for workers_num in range(1, max_workers_num + 1):
+        (_, stats) = transcribe_files(audio_paths, workers_num=workers_num,
+            threads_num=1, transcriptor=transcriptor)
+        scaling.append(stats)
+        print('Workers: {}, files per hour: {:.1f}'.format(workers_num,
+            stats['files_per_hour']))
+
+    return scaling
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Transcribe audio files with '
+        'a pool of CPU worker processes.')
+    parser.add_argument('audio_paths', type=str, nargs='+')
+    parser.add_argument('--midi_dir', type=str, default=None)
+    parser.add_argument('--workers_num', type=int, default=None)
+    parser.add_argument('--threads_num', type=int, default=None)
+    parser.add_argument('--checkpoint_path', type=str, default=None)
+    parser.add_argument('--scaling', action='store_true', default=False,
+        help='Report files per hour from 1 to all CPUs instead')
+    args = parser.parse_args()
+
+    if args.scaling:
+        get_scaling(args.audio_paths, checkpoint_path=args.checkpoint_path)
+    else:
+        if args.midi_dir:
+            os.makedirs(args.midi_dir, exist_ok=True)
+            midi_paths = [os.path.join(args.midi_dir, '{}.mid'.format(
+                os.path.splitext(os.path.basename(path))[0]))
+                for path in args.audio_paths]
+        else:
+            midi_paths = None
+
+        (_, stats) = transcribe_files(args.audio_paths, midi_paths=midi_paths,
+            workers_num=args.workers_num, threads_num=args.threads_num,
+            checkpoint_path=args.checkpoint_path)
+        print('{:.1f} files per hour with {} workers of {} threads'.format(
+            stats['files_per_hour'], stats['workers_num'], stats['threads_num']))
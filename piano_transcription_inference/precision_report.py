@@ -0,0 +1,47 @@
+from .drift_report import get_drift_report, get_report_parser, load_audios
+
+
+def get_precision_report(audios, precision='int8', **kwargs):
+    """Compare a reduced precision with fp32 on reference audio, e.g. audio
+    synthesized by 0_SYNTH.ipynb. The notes transcribed in fp32 are the
+    reference of the drift.
+
+    Args:
+      audios: list of (audio_samples,)
+      precision: str, precision of PianoTranscription to compare
+      kwargs: arguments of PianoTranscription, e.g. checkpoint_path
+
+    Returns:
+      report: dict, {'f1': ..., 'velocity_mae': ..., 'fp32_speed': ...,
+        'speed': ..., 'files': list of dict}, where speeds are seconds of
+        audio transcribed per second
+    """
+    (fp32_result, result) = get_drift_report(audios,
+        [{'precision': 'fp32'}, {'precision': precision}], **kwargs)
+
+    report = {'precision': precision,
+        'f1': result['f1'],
+        'velocity_mae': result['velocity_mae'],
+        'fp32_speed': fp32_result['speed'],
+        'speed': result['speed'],
+        'files': result['files']}
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = get_report_parser('Note F1, velocity error and throughput of a '
+        'reduced precision against fp32.')
+    parser.add_argument('--precision', type=str, default='int8')
+    args = parser.parse_args()
+
+    report = get_precision_report(load_audios(args.audio_paths),
+        precision=args.precision, checkpoint_path=args.checkpoint_path)
+
+    for (path, drift_dict) in zip(args.audio_paths, report['files']):
+        print('{}: F1 {:.4f}, velocity MAE {:.2f}'.format(path, drift_dict['f1'],
+            drift_dict['velocity_mae']))
+
+    print('{} against fp32: note F1 {:.4f}, velocity MAE {:.2f}, speed {:.2f}x '
+        'real time against {:.2f}x'.format(report['precision'], report['f1'],
+        report['velocity_mae'], report['speed'], report['fp32_speed']))
@@ -1,14 +1,16 @@
 import os
+import copy
 import numpy as np
 import time
 import torch
 
 from .utilities import pad_truncate_sequence
+from . import config
 
 
 def move_data_to_device(x, device):
     if 'float' in str(x.dtype):
-        x = torch.Tensor(x)
+        x = torch.Tensor(np.require(x, requirements='W'))
     elif 'int' in str(x.dtype):
         x = torch.LongTensor(x)
     else:
@@ -24,13 +26,136 @@ def append_to_dict(dict, key, value):
         dict[key] = [value]
  
 
-def forward(model, x, batch_size):
-    """Forward data to model in mini-batch. 
+def is_out_of_memory_error(e):
+    """Return True if an exception raised in forward is an out-of-memory error
+    from either the CUDA or the CPU allocator."""
+    return isinstance(e, RuntimeError) and ('out of memory' in str(e) or 
+        "can't allocate memory" in str(e))
+
+
+def quantize_dynamic(model):
+    """Quantize the weights of GRU and Linear layers to int8 for CPU 
+    inference. Activations are quantized on the fly, so no calibration data
+    is needed. Conv layers stay in float32 as dynamic quantization does not
+    support them.
+
+    Args:
+      model: object, quantized in place
+
+    Returns:
+      model: object
+    """
+    return torch.ao.quantization.quantize_dynamic(model, 
+        {torch.nn.GRU, torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def fold_batchnorm(model):
+    """Fold the BatchNorms following convolutions and linear layers into 
+    their weights, for inference only."""
+    for module in list(model.modules()):
+        if hasattr(module, 'fold_bn'):
+            module.fold_bn()
+    return model
+
+
+def export_for_inference(model, segment_samples, script_path, batch_size=2, 
+    tolerance=1e-4):
+    """Fold the BatchNorms of a copy of model, then trace and freeze it and
+    save it as TorchScript. Freezing inlines the weights and removes the 
+    dropouts, which are no-ops at inference. The exported model is checked to
+    give the same outputs as the eager model before folding. model itself is
+    not changed.
+
+    Args:
+      model: object, not quantized
+      segment_samples: int
+      script_path: str
+      batch_size: int, batch size of the check, the exported model runs any
+      tolerance: float, largest absolute output difference allowed
+
+    Returns:
+      diff_dict: dict, largest absolute output difference of each output
+    """
+    if any(type(module).__module__.startswith('torch.ao.nn.quantized') 
+        for module in model.modules()):
+        raise ValueError('Quantized models cannot be exported, their BatchNorms '
+            'cannot be folded. Export the fp32 model instead.')
+
+    model = copy.deepcopy(model)
+    model.eval()
+    device = next(model.parameters()).device
+    xs = [torch.rand(n, segment_samples, device=device) * 2. - 1. 
+        for n in [batch_size, 1]]
+
+    with torch.no_grad():
+        ref_output_dicts = [model(x) for x in xs]
+        fold_batchnorm(model)
+        traced_model = torch.jit.freeze(torch.jit.trace(model, xs[0], 
+            strict=False))
+        output_dicts = [traced_model(x) for x in xs]
+
+    diff_dict = {}
+    for key in ref_output_dicts[0].keys():
+        diff_dict[key] = max(float(torch.max(torch.abs(
+            output_dict[key] - ref_output_dict[key]))) for (output_dict, 
+            ref_output_dict) in zip(output_dicts, ref_output_dicts))
+
+    if max(diff_dict.values()) > tolerance:
+        raise ValueError('Exported model differs from the eager model: '
+            '{}'.format(diff_dict))
+
+    torch.jit.save(traced_model, script_path)
+    return diff_dict
+
+
+def set_conv_dtype(model, dtype):
+    """Run the conv blocks of the model under autocast to dtype, e.g. 
+    torch.bfloat16, or in float32 if dtype is None. The rest of the model 
+    stays in float32."""
+    for module in model.modules():
+        if hasattr(module, 'conv_dtype'):
+            module.conv_dtype = dtype
+    return model
+
+
+def get_auto_batch_size(segment_samples, memory_budget, 
+    bytes_per_second=config.forward_bytes_per_second):
+    """Largest batch size whose estimated activation memory fits the budget.
+
+    Args:
+      segment_samples: int
+      memory_budget: float, bytes
+      bytes_per_second: float, estimated peak bytes per second of audio
+
+    Returns:
+      batch_size: int, at least 1
+    """
+    segment_bytes = segment_samples / config.sample_rate * bytes_per_second
+    return max(int(memory_budget // segment_bytes), 1)
+
+
+def forward(model, x, batch_size, pin_memory=False, copy_dict=None, 
+    segment_indexes=None, device=None, output_dtypes=None):
+    """Forward data to model in mini-batch. If a mini-batch runs out of 
+    memory, the batch size is halved and the mini-batch is retried. Outputs
+    are written into arrays allocated once for all segments.
+
+    Each mini-batch is staged into one reused float32 input tensor, so no 
+    tensor is allocated and no dtype is promoted per mini-batch.
     
     Args: 
       model: object
       x: (N, segment_samples)
       batch_size: int
+      pin_memory: bool, use a page-locked input tensor when forwarding on a 
+        CUDA device
+      copy_dict: None | dict, bytes copied are added to its 'input_bytes', 
+        'device_bytes' and 'output_bytes'
+      segment_indexes: None | (M,), only forward these segments, the outputs
+        of the other segments are zeros. None forwards all segments.
+      device: None | torch.device, default the device of the model parameters
+      output_dtypes: None | dict, dtype to store each output in, e.g. 
+        {'frame_output': np.float16}, default the dtype of the model output
 
     Returns:
       output_dict: dict, e.g. {
@@ -40,27 +165,86 @@ def forward(model, x, batch_size):
     """
     
     output_dict = {}
-    device = next(model.parameters()).device
+    if device is None:
+        device = next(model.parameters()).device
+    on_device = 'cuda' in str(device)
+
+    if output_dtypes is None:
+        output_dtypes = {}
+
+    if copy_dict is None:
+        copy_dict = {}
+    for key in ['input_bytes', 'device_bytes', 'output_bytes']:
+        copy_dict.setdefault(key, 0)
+
+    if segment_indexes is None:
+        segments_num = len(x)
+        allocate = np.empty
+    else:
+        segments_num = len(segment_indexes)
+        allocate = np.zeros
+
+    input_tensor = torch.empty((min(batch_size, segments_num),) + x.shape[1 :], 
+        dtype=torch.float32, pin_memory=(pin_memory and on_device))
     
     pointer = 0
-    total_segments = int(np.ceil(len(x) / batch_size))
+    batch_index = 0
+    total_segments = int(np.ceil(segments_num / batch_size))
     
     while True:
-        print('Segment {} / {}'.format(pointer, total_segments))
-        if pointer >= len(x):
+        print('Segment {} / {}'.format(batch_index, total_segments))
+        if pointer >= segments_num:
             break
 
-        batch_waveform = move_data_to_device(x[pointer : pointer + batch_size], device)
-        pointer += batch_size
+        if segment_indexes is None:
+            batch_indexes = slice(pointer, pointer + batch_size)
+        else:
+            batch_indexes = segment_indexes[pointer : pointer + batch_size]
+
+        batch = x[batch_indexes]
+        batch_input = input_tensor[0 : len(batch)]
+        np.copyto(batch_input.numpy(), batch, casting='same_kind')
+        copy_dict['input_bytes'] += batch_input.numpy().nbytes
+
+        if on_device:
+            batch_waveform = batch_input.to(device, non_blocking=pin_memory)
+            copy_dict['device_bytes'] += batch_input.numpy().nbytes
+        else:
+            batch_waveform = batch_input
 
-        with torch.no_grad():
-            model.eval()
-            batch_output_dict = model(batch_waveform)
+        out_of_memory = False
+        try:
+            with torch.no_grad():
+                model.eval()
+                batch_output_dict = model(batch_waveform)
+        except RuntimeError as e:
+            if not is_out_of_memory_error(e) or batch_size == 1:
+                raise
+            out_of_memory = True
+
+        if out_of_memory:
+            # Outside of the except block, the traceback no longer holds the 
+            # activations of the failed batch, so that their memory is freed
+            del batch_waveform
+            if on_device:
+                torch.cuda.empty_cache()
+            batch_size = batch_size // 2
+            total_segments = batch_index + int(np.ceil(
+                (segments_num - pointer) / batch_size))
+            print('Out of memory, retry with batch size {}.'.format(batch_size))
+            continue
 
         for key in batch_output_dict.keys():
-            append_to_dict(output_dict, key, batch_output_dict[key].data.cpu().numpy())
+            batch_output = batch_output_dict[key].data.cpu().numpy()
+            if key not in output_dict.keys():
+                output_dict[key] = allocate((len(x),) + batch_output.shape[1 :], 
+                    dtype=output_dtypes.get(key, batch_output.dtype))
+            output_dict[key][batch_indexes] = batch_output
+            copy_dict['output_bytes'] += batch_output.nbytes
+            if on_device:
+                copy_dict['device_bytes'] += batch_output.nbytes
 
-    for key in output_dict.keys():
-        output_dict[key] = np.concatenate(output_dict[key], axis=0)
+        pointer += batch_size
+        batch_index += 1
 
     return output_dict
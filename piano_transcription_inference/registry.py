@@ -0,0 +1,163 @@
+import os
+import json
+import hashlib
+import argparse
+
+import numpy as np
+import torch
+
+from . import config
+
+
+alignment = 64  # Bytes, offset alignment of each tensor in weights.bin
+
+
+def get_model_dir(name, registry_dir=None):
+    return os.path.join(registry_dir or config.registry_dir, name)
+
+
+def get_sha256(path, chunk_bytes=2 ** 24):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def flatten_state_dict(state_dict, prefix=''):
+    """{'note_model': {'conv.weight': tensor}} -> {'note_model/conv.weight': tensor}"""
+    flat_dict = {}
+    for key in state_dict.keys():
+        if isinstance(state_dict[key], dict):
+            flat_dict.update(flatten_state_dict(state_dict[key],
+                '{}{}/'.format(prefix, key)))
+        else:
+            flat_dict[prefix + key] = state_dict[key]
+    return flat_dict
+
+
+def unflatten_state_dict(flat_dict):
+    """{'note_model/conv.weight': tensor} -> {'note_model': {'conv.weight': tensor}}"""
+    state_dict = {}
+    for key in flat_dict.keys():
+        keys = key.split('/')
+        d = state_dict
+        for k in keys[: -1]:
+            d = d.setdefault(k, {})
+        d[keys[-1]] = flat_dict[key]
+    return state_dict
+
+
+def convert_checkpoint(checkpoint_path, name, registry_dir=None):
+    """Convert checkpoint['model'] of a .pth checkpoint to a model of the
+    registry. Done once, after which the model is loaded with load_model().
+
+    The tensors are written one after another into weights.bin, and their
+    names, dtypes, shapes and offsets into index.json together with the
+    sha256, size and modification time of weights.bin.
+
+    Args:
+      checkpoint_path: str
+      name: str, name of the model in the registry
+      registry_dir: None | str, default config.registry_dir
+
+    Returns:
+      model_dir: str
+    """
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    flat_dict = flatten_state_dict(checkpoint['model'])
+
+    model_dir = get_model_dir(name, registry_dir)
+    os.makedirs(model_dir, exist_ok=True)
+    weights_path = os.path.join(model_dir, 'weights.bin')
+
+    tensors = {}
+    offset = 0
+
+    with open(weights_path, 'wb') as f:
+        for key in flat_dict.keys():
+            array = flat_dict[key].detach().cpu().contiguous().numpy()
+            offset = -(-offset // alignment) * alignment
+            f.seek(offset)
+            f.write(array.tobytes())
+            tensors[key] = {'dtype': array.dtype.str, 'shape': list(array.shape),
+                'offset': offset}
+            offset += array.nbytes
+
+    index = {'checkpoint_path': os.path.abspath(checkpoint_path),
+        'sha256': get_sha256(weights_path), 'stat': get_stat(weights_path), 
+        'tensors': tensors}
+
+    with open(os.path.join(model_dir, 'index.json'), 'w') as f:
+        json.dump(index, f, indent=2)
+
+    print('Converted {} to {}'.format(checkpoint_path, model_dir))
+    return model_dir
+
+
+def get_stat(path):
+    """Size and modification time of a file, which change when it is 
+    rewritten."""
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def load_model(name, registry_dir=None, verify=None):
+    """Load a model of the registry as a state dict of tensors memory-mapped
+    from weights.bin. No weights are read or copied until they are used, and
+    processes loading the same model share its pages.
+
+    Args:
+      name: str, name of the model in the registry
+      registry_dir: None | str, default config.registry_dir
+      verify: None | bool, check the sha256 of weights.bin, which reads the
+        whole file. None only checks it if the size or modification time of 
+        weights.bin changed since the conversion, which computed the sha256.
+
+    Returns:
+      state_dict: dict, e.g. {'note_model': {...}, 'pedal_model': {...}}
+    """
+    model_dir = get_model_dir(name, registry_dir)
+    index_path = os.path.join(model_dir, 'index.json')
+    weights_path = os.path.join(model_dir, 'weights.bin')
+
+    if not os.path.exists(index_path) or not os.path.exists(weights_path):
+        raise FileNotFoundError('Model {} is not in the registry {}. Convert a '
+            'checkpoint first with convert_checkpoint(checkpoint_path, '
+            '"{}").'.format(name, os.path.dirname(model_dir), name))
+
+    with open(index_path) as f:
+        index = json.load(f)
+
+    if verify is None:
+        verify = index.get('stat') != get_stat(weights_path)
+
+    if verify and get_sha256(weights_path) != index['sha256']:
+        raise ValueError('Checksum of {} does not match {}, the model is '
+            'corrupted. Convert the checkpoint again.'.format(weights_path,
+            index_path))
+
+    # Copy-on-write, pages are shared until written
+    weights = np.memmap(weights_path, dtype=np.uint8, mode='c')
+
+    flat_dict = {}
+    for key in index['tensors'].keys():
+        t = index['tensors'][key]
+        dtype = np.dtype(t['dtype'])
+        count = int(np.prod(t['shape']))
+        array = np.frombuffer(weights, dtype=dtype, count=count,
+            offset=t['offset']).reshape(t['shape'])
+        flat_dict[key] = torch.from_numpy(array)
+
+    return unflatten_state_dict(flat_dict)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert a checkpoint to a '
+        'memory-mapped model of the registry.')
+    parser.add_argument('checkpoint_path', type=str)
+    parser.add_argument('name', type=str)
+    parser.add_argument('--registry_dir', type=str, default=None)
+    args = parser.parse_args()
+
+    convert_checkpoint(args.checkpoint_path, args.name, args.registry_dir)
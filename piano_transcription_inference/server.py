@@ -0,0 +1,286 @@
+import io
+import json
+import time
+import queue
+import argparse
+import threading
+import collections
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+from .inference import PianoTranscription
+from .utilities import load_audio, write_events_to_midi
+from .tables import EventTable
+from . import config
+
+
+class TranscriptionServer(object):
+    def __init__(self, host='127.0.0.1', port=8000, workers_num=1,
+        queue_size=16, latencies_num=1000, **kwargs):
+        """Long-lived local HTTP server. The model is loaded once and jobs are
+        transcribed by a pool of worker threads sharing it.
+
+        Endpoints:
+          POST /transcribe?format=midi|events, body is either JSON
+            {"audio_path": str} or raw float32 mono PCM at config.sample_rate.
+            Returns MIDI bytes or JSON {"est_note_events": ...,
+            "est_pedal_events": ...}. Returns 400 for a malformed body and 503
+            when the queue is full.
+          GET /stats, returns JSON with queue depth, job counts and latencies.
+
+        Args:
+          host: str
+          port: int
+          workers_num: int, jobs transcribed at the same time
+          queue_size: int, jobs waiting for a worker
+          latencies_num: int, latest jobs used for the latency stats
+          kwargs: arguments of PianoTranscription, e.g. checkpoint_path, device
+        """
+        self.transcriptor = PianoTranscription(**kwargs)
+        self.jobs = queue.Queue(maxsize=queue_size)
+
+        self.lock = threading.Lock()
+        self.stats = {'jobs_done': 0, 'jobs_failed': 0, 'jobs_rejected': 0,
+            'workers_busy': 0}
+        self.latencies = collections.deque(maxlen=latencies_num)
+        """(wait_time, total_time) of the latest jobs"""
+
+        self.workers = [threading.Thread(target=self.work, daemon=True)
+            for _ in range(workers_num)]
+        for worker in self.workers:
+            worker.start()
+
+        self.httpd = ThreadingHTTPServer((host, port), self.get_handler())
+        print('Serving on http://{}:{}'.format(host, self.httpd.server_port))
+
+    def submit(self, audio_path=None, audio=None, format='midi'):
+        """Queue a job and wait for its result.
+
+        Args:
+          audio_path: None | str
+          audio: None | (audio_samples,), float32 at config.sample_rate
+          format: 'midi' | 'events'
+
+        Returns:
+          job: dict, {'result': bytes | dict, 'error': None | str, ...}
+
+        Raises:
+          queue.Full: if the queue is full
+        """
+        assert format in ['midi', 'events']
+        job = {'audio_path': audio_path, 'audio': audio, 'format': format,
+            'done': threading.Event(), 'result': None, 'error': None,
+            'submit_time': time.time()}
+
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                self.stats['jobs_rejected'] += 1
+            raise
+
+        job['done'].wait()
+        return job
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+
+            start_time = time.time()
+            with self.lock:
+                self.stats['workers_busy'] += 1
+
+            try:
+                job['result'] = self.transcribe(job)
+                failed = False
+            except Exception as e:
+                job['error'] = '{}: {}'.format(type(e).__name__, e).replace('\n', ' ')
+                failed = True
+
+            end_time = time.time()
+            with self.lock:
+                self.stats['workers_busy'] -= 1
+                self.stats['jobs_failed' if failed else 'jobs_done'] += 1
+                self.latencies.append((start_time - job['submit_time'],
+                    end_time - job['submit_time']))
+
+            job['done'].set()
+
+    def transcribe(self, job):
+        if job['audio'] is None:
+            (audio, _) = load_audio(job['audio_path'], sr=config.sample_rate,
+                mono=True)
+        else:
+            audio = job['audio']
+
+        transcribed_dict = self.transcriptor.transcribe(audio, None)
+
+        if job['format'] == 'midi':
+            buffer = io.BytesIO()
+            write_events_to_midi(start_time=0,
+                note_events=transcribed_dict['est_note_events'],
+                pedal_events=transcribed_dict['est_pedal_events'],
+                midi_path=buffer)
+            return buffer.getvalue()
+        else:
+            return {'est_note_events': transcribed_dict['est_note_events'],
+                'est_pedal_events': transcribed_dict['est_pedal_events']}
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            latencies = np.array(self.latencies).reshape(-1, 2)
+
+        stats['queue_depth'] = self.jobs.qsize()
+        stats['workers_num'] = len(self.workers)
+
+        for (n, key) in enumerate(['wait_seconds', 'latency_seconds']):
+            if len(latencies) == 0:
+                stats[key] = None
+            else:
+                stats[key] = {'mean': float(np.mean(latencies[:, n])),
+                    'p50': float(np.percentile(latencies[:, n], 50)),
+                    'p95': float(np.percentile(latencies[:, n], 95)),
+                    'max': float(np.max(latencies[:, n]))}
+
+        return stats
+
+    def get_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if urlparse(self.path).path != '/stats':
+                    self.send_error(404)
+                    return
+                self.send_json(server.get_stats())
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if url.path != '/transcribe':
+                    self.send_error(404)
+                    return
+
+                format = parse_qs(url.query).get('format', ['midi'])[0]
+                if format not in ['midi', 'events']:
+                    self.send_error(400, 'Unknown format {}'.format(format))
+                    return
+
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+                if self.headers.get('Content-Type') == 'application/json':
+                    try:
+                        audio_path = json.loads(body)['audio_path']
+                    except (ValueError, KeyError, TypeError):
+                        self.send_error(400, 'Expected a JSON object with '
+                            'an audio_path')
+                        return
+                    if not isinstance(audio_path, str):
+                        self.send_error(400, 'audio_path must be a string')
+                        return
+                    audio = None
+                else:
+                    if len(body) % 4 != 0:
+                        self.send_error(400, 'Expected float32 samples, got '
+                            '{} bytes'.format(len(body)))
+                        return
+                    audio_path = None
+                    audio = np.frombuffer(body, dtype=np.float32)
+
+                try:
+                    job = server.submit(audio_path=audio_path, audio=audio,
+                        format=format)
+                except queue.Full:
+                    self.send_error(503, 'Queue is full')
+                    return
+
+                if job['error'] is not None:
+                    self.send_error(500, job['error'])
+                elif format == 'midi':
+                    self.send_bytes(job['result'], 'audio/midi')
+                else:
+                    self.send_json(job['result'])
+
+            def send_json(self, data):
+                self.send_bytes(json.dumps(data, default=lambda x: x.events 
+                    if isinstance(x, EventTable) else x.item()).encode(), 
+                    'application/json')
+
+            def send_bytes(self, data, content_type):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+
+
+def request_transcription(audio_path=None, audio=None, format='midi',
+    host='127.0.0.1', port=8000):
+    """Transcribe with a running TranscriptionServer.
+
+    Args:
+      audio_path: None | str, read by the server
+      audio: None | (audio_samples,), mono at config.sample_rate
+      format: 'midi' | 'events'
+
+    Returns:
+      bytes of a MIDI file | dict of events
+    """
+    if audio is None:
+        data = json.dumps({'audio_path': audio_path}).encode()
+        content_type = 'application/json'
+    else:
+        data = np.ascontiguousarray(audio, dtype=np.float32).tobytes()
+        content_type = 'application/octet-stream'
+
+    request = urllib.request.Request(
+        'http://{}:{}/transcribe?format={}'.format(host, port, format),
+        data=data, headers={'Content-Type': content_type})
+
+    with urllib.request.urlopen(request) as response:
+        result = response.read()
+
+    if format == 'midi':
+        return result
+    else:
+        return json.loads(result)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Piano transcription server.')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers_num', type=int, default=1)
+    parser.add_argument('--queue_size', type=int, default=16)
+    parser.add_argument('--checkpoint_path', type=str, default=None)
+    parser.add_argument('--device', type=str, default='cuda')
+    parser.add_argument('--batch_size', type=int, default=1)
+    args = parser.parse_args()
+
+    server = TranscriptionServer(host=args.host, port=args.port,
+        workers_num=args.workers_num, queue_size=args.queue_size,
+        checkpoint_path=args.checkpoint_path, device=args.device,
+        batch_size=args.batch_size)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
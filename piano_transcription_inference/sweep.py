@@ -0,0 +1,204 @@
+import os
+import argparse
+import itertools
+import concurrent.futures
+import multiprocessing as mp
+
+import numpy as np
+
+from .utilities import RegressionPostProcessor, get_note_drift
+from . import config
+
+
+_sweep_dict = {}
+"""Shared state of the grid points of a sweep: {'output_dict': ...,
+'peaks_dict': ..., 'frames_per_second': ...}"""
+
+
+def _init_sweep(sweep_dict):
+    _sweep_dict.clear()
+    _sweep_dict.update(sweep_dict)
+
+
+def get_post_processor(onset_threshold=0.3, offset_threshold=0.3,
+    frame_threshold=0.1, pedal_offset_threshold=0.2):
+    return RegressionPostProcessor(_sweep_dict['frames_per_second'],
+        classes_num=config.classes_num, onset_threshold=onset_threshold,
+        offset_threshold=offset_threshold, frame_threshold=frame_threshold,
+        pedal_offset_threshold=pedal_offset_threshold)
+
+
+def binarize_peaks(key, threshold):
+    """Binarized output and shifts of the peaks of output key above threshold,
+    the same as RegressionPostProcessor.get_binarized_output_from_regression().
+    """
+    reg_output = _sweep_dict['output_dict'][key]
+    (n, k, shift, values) = _sweep_dict['peaks_dict'][key]
+    keep = values > threshold
+
+    binary_output = np.zeros(reg_output.shape, dtype=bool)
+    shift_output = np.zeros(reg_output.shape, dtype=shift.dtype)
+    binary_output[n[keep], k[keep]] = True
+    shift_output[n[keep], k[keep]] = shift[keep]
+
+    return binary_output, shift_output
+
+
+def _sweep_notes(thresholds):
+    (onset_threshold, offset_threshold, frame_threshold) = thresholds
+    output_dict = _sweep_dict['output_dict']
+
+    post_processor = get_post_processor(onset_threshold=onset_threshold,
+        offset_threshold=offset_threshold, frame_threshold=frame_threshold)
+
+    note_dict = {'frame_output': output_dict['frame_output'],
+        'velocity_output': output_dict['velocity_output']}
+    (note_dict['onset_output'], note_dict['onset_shift_output']) = \
+        binarize_peaks('reg_onset_output', onset_threshold)
+    (note_dict['offset_output'], note_dict['offset_shift_output']) = \
+        binarize_peaks('reg_offset_output', offset_threshold)
+
+    est_on_off_note_vels = post_processor.output_dict_to_detected_notes(note_dict)
+    est_note_events = post_processor.detected_notes_to_events(est_on_off_note_vels)
+
+    if _sweep_dict['ref_note_events'] is None:
+        return est_note_events
+    else:
+        return get_note_drift(_sweep_dict['ref_note_events'], est_note_events,
+            onset_tolerance=_sweep_dict['onset_tolerance'])
+
+
+def _sweep_pedals(pedal_offset_threshold):
+    output_dict = _sweep_dict['output_dict']
+    post_processor = get_post_processor(
+        pedal_offset_threshold=pedal_offset_threshold)
+
+    pedal_dict = {'pedal_frame_output': output_dict['pedal_frame_output']}
+    (pedal_dict['pedal_offset_output'], pedal_dict['pedal_offset_shift_output']) = \
+        binarize_peaks('reg_pedal_offset_output', pedal_offset_threshold)
+
+    est_pedal_on_offs = post_processor.output_dict_to_detected_pedals(pedal_dict)
+    return post_processor.detected_pedals_to_events(est_pedal_on_offs)
+
+
+def sweep_thresholds(output_dict, onset_thresholds=[0.3], offset_thresholds=[0.3],
+    frame_thresholds=[0.1], pedal_offset_thresholds=[0.2], ref_note_events=None,
+    onset_tolerance=0.05, workers_num=None,
+    frames_per_second=config.frames_per_second):
+    """Post process one output_dict with every combination of thresholds.
+    Each grid point gives the same events as RegressionPostProcessor with
+    its thresholds.
+
+    The peaks of the onset, offset and pedal offset regression outputs are
+    found once for all thresholds. Note events depend on the onset, offset
+    and frame thresholds, pedal events only on the pedal offset threshold,
+    so pedals are detected once per pedal offset threshold. Grid points run
+    in parallel in workers_num processes.
+
+    Args:
+      output_dict: dict, deframed outputs, e.g. transcribed_dict['output_dict']
+        of PianoTranscription.transcribe()
+      onset_thresholds: list of float
+      offset_thresholds: list of float
+      frame_thresholds: list of float
+      pedal_offset_thresholds: list of float
+      ref_note_events: None | list of dict, return note metrics against these
+        notes instead of note events, see get_note_drift()
+      onset_tolerance: float, seconds
+      workers_num: None | int, default all CPUs
+      frames_per_second: int
+
+    Returns:
+      results: list of dict, e.g. [{'onset_threshold': 0.3,
+        'offset_threshold': 0.3, 'frame_threshold': 0.1,
+        'pedal_offset_threshold': 0.2, 'est_note_events': ...,
+        'est_pedal_events': ...}, ...], with 'precision', 'recall', 'f1' and
+        'velocity_mae' instead of 'est_note_events' if ref_note_events is
+        given
+    """
+    sweep_dict = {'output_dict': output_dict, 'peaks_dict': {},
+        'frames_per_second': frames_per_second,
+        'ref_note_events': ref_note_events, 'onset_tolerance': onset_tolerance}
+
+    _init_sweep(sweep_dict)
+    post_processor = get_post_processor()
+
+    for (key, neighbour) in [('reg_onset_output', 2), ('reg_offset_output', 4),
+        ('reg_pedal_offset_output', 4)]:
+        if key in output_dict.keys():
+            (n, k, shift) = post_processor.get_regression_peaks(output_dict[key],
+                neighbour)
+            sweep_dict['peaks_dict'][key] = (n, k, shift, output_dict[key][n, k])
+
+    note_grid = list(itertools.product(onset_thresholds, offset_thresholds,
+        frame_thresholds))
+    has_pedals = 'pedal_frame_output' in output_dict.keys()
+
+    if workers_num is None:
+        workers_num = len(os.sched_getaffinity(0)) \
+            if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+
+    if workers_num > 1 and 'fork' in mp.get_all_start_methods():
+        # Forked workers share sweep_dict without copying the outputs
+        with concurrent.futures.ProcessPoolExecutor(workers_num,
+            mp_context=mp.get_context('fork'), initializer=_init_sweep,
+            initargs=(sweep_dict,)) as executor:
+
+            notes = list(executor.map(_sweep_notes, note_grid))
+            pedals = list(executor.map(_sweep_pedals, pedal_offset_thresholds)) \
+                if has_pedals else None
+    else:
+        notes = [_sweep_notes(thresholds) for thresholds in note_grid]
+        pedals = [_sweep_pedals(threshold) for threshold in pedal_offset_thresholds] \
+            if has_pedals else None
+
+    _sweep_dict.clear()
+
+    results = []
+    for (i, (onset_threshold, offset_threshold, frame_threshold)) in enumerate(note_grid):
+        for (j, pedal_offset_threshold) in enumerate(pedal_offset_thresholds):
+            result = {'onset_threshold': onset_threshold,
+                'offset_threshold': offset_threshold,
+                'frame_threshold': frame_threshold,
+                'pedal_offset_threshold': pedal_offset_threshold,
+                'est_pedal_events': pedals[j] if has_pedals else None}
+
+            if ref_note_events is None:
+                result['est_note_events'] = notes[i]
+            else:
+                result.update(notes[i])
+
+            results.append(result)
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Note and pedal numbers of a '
+        'grid of thresholds on cached outputs.')
+    parser.add_argument('entry_dir', type=str, help='Entry of an OutputCache, '
+        'i.e. cache_dir/key')
+    parser.add_argument('--onset_thresholds', type=float, nargs='+', default=[0.3])
+    parser.add_argument('--offset_thresholds', type=float, nargs='+', default=[0.3])
+    parser.add_argument('--frame_thresholds', type=float, nargs='+', default=[0.1])
+    parser.add_argument('--pedal_offset_thresholds', type=float, nargs='+', 
+        default=[0.2])
+    parser.add_argument('--workers_num', type=int, default=None)
+    args = parser.parse_args()
+
+    output_dict = {os.path.splitext(name)[0]: np.load(os.path.join(
+        args.entry_dir, name), mmap_mode='r') for name in os.listdir(args.entry_dir)}
+
+    results = sweep_thresholds(output_dict, 
+        onset_thresholds=args.onset_thresholds, 
+        offset_thresholds=args.offset_thresholds, 
+        frame_thresholds=args.frame_thresholds, 
+        pedal_offset_thresholds=args.pedal_offset_thresholds, 
+        workers_num=args.workers_num)
+
+    for result in results:
+        print('onset {:.2f}, offset {:.2f}, frame {:.2f}, pedal offset {:.2f}: '
+            '{} notes, {} pedals'.format(result['onset_threshold'], 
+            result['offset_threshold'], result['frame_threshold'], 
+            result['pedal_offset_threshold'], len(result['est_note_events']), 
+            len(result['est_pedal_events'] or [])))
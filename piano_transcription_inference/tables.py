@@ -0,0 +1,88 @@
+import numpy as np
+
+
+class EventTable(object):
+    """Columnar events, one array per field. The table is also a sequence
+    of event dicts, e.g. {'onset_time': ..., 'offset_time': ...}, which are
+    only built when the table is indexed or iterated."""
+    fields = ()
+    __slots__ = ('_events',)
+
+    def __init__(self, **columns):
+        """
+        Args:
+          columns: (events_num,) of each field
+        """
+        for field in self.fields:
+            setattr(self, field, np.asarray(columns[field]))
+        self._events = None
+
+    def __len__(self):
+        return len(getattr(self, self.fields[0]))
+
+    @property
+    def events(self):
+        """List of dict, the same as RegressionPostProcessor returns without
+        tables."""
+        if self._events is None:
+            # Times keep their numpy type, integers are python ints
+            columns = [getattr(self, field) if getattr(self, field).dtype.kind == 'f'
+                else getattr(self, field).tolist() for field in self.fields]
+            self._events = [dict(zip(self.fields, values)) for values in zip(*columns)]
+        return self._events
+
+    def __getitem__(self, index):
+        return self.events[index]
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def __eq__(self, other):
+        if isinstance(other, EventTable):
+            return self.fields == other.fields and all(np.array_equal(
+                getattr(self, field), getattr(other, field)) for field in self.fields)
+        return self.events == other
+
+    def __repr__(self):
+        return '{}({} events)'.format(type(self).__name__, len(self))
+
+    def get_array(self):
+        """Returns:
+          array: (events_num, fields_num), in the dtype of the times
+        """
+        dtype = getattr(self, self.fields[0]).dtype
+        array = np.zeros((len(self), len(self.fields)), dtype=dtype)
+        for (j, field) in enumerate(self.fields):
+            array[:, j] = getattr(self, field)
+        return array
+
+    def save(self, path):
+        """Save the columns to an .npz file."""
+        np.savez(path, **{field: getattr(self, field) for field in self.fields})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as npz:
+            return cls(**{field: npz[field] for field in cls.fields})
+
+    @classmethod
+    def from_events(cls, events):
+        """Args:
+          events: list of dict
+        """
+        return cls(**{field: [event[field] for event in events]
+            for field in cls.fields})
+
+
+class NoteTable(EventTable):
+    """Notes, e.g. NoteTable(onset_time=[39.7376, 11.9824],
+    offset_time=[39.75, 12.50], midi_note=[27, 33], velocity=[84, 88])"""
+    fields = ('onset_time', 'offset_time', 'midi_note', 'velocity')
+    __slots__ = fields
+
+
+class PedalTable(EventTable):
+    """Sustain pedals, e.g. PedalTable(onset_time=[0.18, 1.14],
+    offset_time=[0.9669, 2.6458])"""
+    fields = ('onset_time', 'offset_time')
+    __slots__ = fields
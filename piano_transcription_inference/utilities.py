@@ -1,4 +1,8 @@
 import os
+import struct
+import tempfile
+import subprocess
+import functools
 import numpy as np
 import audioread
 import librosa
@@ -6,6 +10,7 @@ from mido import MidiFile
 
 from .piano_vad import (note_detection_with_onset_offset_regress, 
     pedal_detection_with_onset_offset_regress)
+from .tables import NoteTable, PedalTable
 from . import config
 
 
@@ -85,84 +90,701 @@ def read_midi(midi_path):
     return midi_dict
 
 
-def write_events_to_midi(start_time, note_events, pedal_events, midi_path):
-    """Write out note events to MIDI file.
+midi_event_types = {'note_off': 0x80, 'note_on': 0x90, 'polytouch': 0xa0, 
+    'control_change': 0xb0, 'program_change': 0xc0, 'aftertouch': 0xd0, 
+    'pitchwheel': 0xe0}
+"""Values of the type field of read_midi_events(), the status without the
+channel"""
+
+midi_event_dtype = np.dtype([('time_sec', np.float64), ('tick', np.int64), 
+    ('track', np.int16), ('type', np.uint8), ('channel', np.uint8), 
+    ('note', np.int16), ('velocity', np.int16), ('control', np.int16), 
+    ('value', np.int32)])
+
+
+def decode_variable_ints(x, positions=None):
+    """Decode MIDI variable-length quantities starting at positions.
+
+    Args:
+      x: (bytes_num,), int, padded with at least 4 bytes
+      positions: None | (n,), int, None for every byte but the padding
+
+    Returns:
+      values: (n,), int
+      lengths: (n,), int, number of bytes of each value
+    """
+    if positions is None:
+        n = len(x) - 4
+        b = [x[j : j + n] for j in range(4)]
+    else:
+        b = [x[positions + j] for j in range(4)]
+
+    values = b[0] & 0x7f
+    lengths = np.ones_like(values)
+    reading = b[0] >= 0x80
+
+    for j in range(1, 4):
+        values = np.where(reading, (values << 7) | (b[j] & 0x7f), values)
+        lengths += reading
+        reading &= b[j] >= 0x80
+
+    return values, lengths
+
+
+def read_midi_track(data, positions=False):
+    """Parse the messages of a MIDI track chunk.
+
+    Message boundaries are the only sequential part of a track. The length 
+    of a message starting at each byte is calculated for all bytes at once, 
+    then the boundaries are followed from the first byte.
+
+    Args:
+      data: bytes, the track chunk without its header
+      positions: bool, also return where each message is in data
+
+    Returns:
+      ticks: (messages_num,), int64, from the start of the track
+      status: (messages_num,), int64, status byte, with running status 
+        resolved
+      data1: (messages_num,), int64, first byte after the status, e.g. the 
+        note of note_on or the type of a meta message
+      data2: (messages_num,), int64, second byte after the status
+      tempo_ticks: (tempos_num,), int64, ticks of set_tempo messages
+      tempos: (tempos_num,), int64, microseconds per beat
+      status_positions: (messages_num,), int64, the status byte, or the first
+        data byte under running status, only if positions
+      ends: (messages_num,), int64, the byte after the message, only if 
+        positions
+    """
+    bytes_num = len(data)
+    x = np.zeros(bytes_num + 16, dtype=np.int32)
+    x[0 : bytes_num] = np.frombuffer(data, dtype=np.uint8)
+
+    # Suppose a message starts at every byte
+    (deltas, delta_lengths) = decode_variable_ints(x[0 : bytes_num + 4])
+    status_positions = np.arange(bytes_num, dtype=np.int32) + delta_lengths
+    status = x[status_positions]
+    hi = status & 0xf0
+
+    # Next message after a message with its own status byte, channel messages
+    # have 1 or 2 data bytes, meta and sysex messages give their length
+    data_lengths = np.where((hi == 0xc0) | (hi == 0xd0), 1, 2)
+    next_positions = np.where(status < 0xf0, status_positions + 1 + data_lengths, -1)
+
+    for (status_byte, offset) in [(0xff, 2), (0xf0, 1), (0xf7, 1)]:
+        indexes = np.nonzero(status == status_byte)[0]
+        (lengths, length_lengths) = decode_variable_ints(x, 
+            status_positions[indexes] + offset)
+        next_positions[indexes] = status_positions[indexes] + offset + \
+            length_lengths + lengths
+
+    # Messages without a status byte use the running status, encoded as
+    # -1 - status_position, which is less than -1. -1 is an unknown status.
+    next_positions = np.where(status >= 0x80, next_positions, -1 - status_positions)
+    next_list = next_positions.tolist()
+
+    # Channel messages set the running status, to their number of data bytes
+    running_list = np.where((status >= 0x80) & (status < 0xf0), data_lengths, 
+        0).tolist()
+
+    starts = []
+    append = starts.append
+    p = 0
+    running = 0
+
+    while p < bytes_num:
+        append(p)
+        q = next_list[p]
+        if q >= 0:
+            if running_list[p]:
+                running = running_list[p]
+            p = q
+        elif q == -1:
+            raise ValueError('Unknown status {} at byte {}.'.format(
+                hex(status[p]), p))
+        elif running:
+            p = running - 1 - q
+        else:
+            raise ValueError('Running status without a previous status at '
+                'byte {}.'.format(p))
+
+    if p > bytes_num:
+        raise ValueError('The last message runs over the end of the track.')
+
+    starts = np.array(starts, dtype=np.int64)
+    ticks = np.cumsum(deltas[starts], dtype=np.int64)
+    status_positions = status_positions[starts]
+    meta_length_lengths = decode_variable_ints(x, status_positions + 2)[1]
+    status = status[starts].astype(np.int64)
+    explicit = status >= 0x80
+
+    # Resolve running status from the latest channel message
+    is_channel = explicit & (status < 0xf0)
+    latest = np.maximum.accumulate(np.where(is_channel, 
+        np.arange(len(starts)), 0))
+    status = np.where(explicit, status, status[latest])
+    data_positions = status_positions + explicit
+    (data1, data2) = (x[data_positions].astype(np.int64), 
+        x[data_positions + 1].astype(np.int64))
+
+    # Tempo changes, meta type 0x51 with 3 bytes of microseconds per beat
+    is_tempo = (status == 0xff) & (data1 == 0x51)
+    tempo_positions = (status_positions + 2 + meta_length_lengths)[is_tempo]
+    tempos = (x[tempo_positions].astype(np.int64) << 16) | \
+        (x[tempo_positions + 1] << 8) | x[tempo_positions + 2]
+
+    if positions:
+        ends = np.append(starts[1 :], bytes_num)
+        return (ticks, status, data1, data2, ticks[is_tempo], tempos, 
+            status_positions.astype(np.int64), ends)
+
+    return ticks, status, data1, data2, ticks[is_tempo], tempos
+
+
+def read_midi_chunks(midi_path):
+    """Split a MIDI file into its header and track chunks.
+
+    Args:
+      midi_path: str | bytes, path or content of a MIDI file
+
+    Returns:
+      header: bytes, the header chunk
+      ticks_per_beat: int
+      track_datas: list of bytes, the track chunks without their headers
+    """
+    if isinstance(midi_path, bytes):
+        data = midi_path
+    else:
+        with open(midi_path, 'rb') as f:
+            data = f.read()
+
+    if data[0 : 4] != b'MThd':
+        raise ValueError('Not a MIDI file.')
+
+    (header_length, _, _, ticks_per_beat) = struct.unpack('>IHHH', data[4 : 14])
+    if ticks_per_beat & 0x8000:
+        raise ValueError('SMPTE time division is not supported.')
+
+    track_datas = []
+    position = 8 + header_length
+
+    while position + 8 <= len(data):
+        (name, length) = struct.unpack('>4sI', data[position : position + 8])
+        if name == b'MTrk':
+            track_datas.append(data[position + 8 : position + 8 + length])
+        position += 8 + length
+
+    return data[0 : 8 + header_length], ticks_per_beat, track_datas
+
+
+def read_midi_events(midi_path):
+    """Parse the channel messages of all tracks of a MIDI file into an 
+    array, with times in seconds from the tempo map of all tracks. Events 
+    are sorted by time, and events at the same time keep the order of 
+    tracks and messages, the same as iterating a mido.MidiFile.
+
+    Args:
+      midi_path: str | bytes, path or content of a MIDI file
+
+    Returns:
+      events: (events_num,), midi_event_dtype, fields are time_sec, tick, 
+        track, type (see midi_event_types), channel, note (note_on, note_off,
+        polytouch), velocity (note_on, note_off), control (control_change) 
+        and value (control value, program, pressure, or pitch in 
+        [-8192, 8191] of pitchwheel). Fields that do not apply are -1.
+      ticks_per_beat: int
+    """
+    (_, ticks_per_beat, track_datas) = read_midi_chunks(midi_path)
+    tracks = [read_midi_track(track_data) for track_data in track_datas]
+
+    ticks = np.concatenate([track[0] for track in tracks] + [[]]).astype(np.int64)
+    status = np.concatenate([track[1] for track in tracks] + [[]]).astype(np.int64)
+    data1 = np.concatenate([track[2] for track in tracks] + [[]]).astype(np.int64)
+    data2 = np.concatenate([track[3] for track in tracks] + [[]]).astype(np.int64)
+    track_indexes = np.concatenate([np.full(len(track[0]), n) 
+        for (n, track) in enumerate(tracks)] + [[]]).astype(np.int64)
+
+    # Tempo map, 120 BPM until the first tempo change
+    tempo_ticks = np.concatenate([[0]] + [track[4] for track in tracks]).astype(np.int64)
+    tempos = np.concatenate([[500000]] + [track[5] for track in tracks]).astype(np.int64)
+    indexes = np.argsort(tempo_ticks, kind='stable')
+    (tempo_ticks, tempos) = (tempo_ticks[indexes], tempos[indexes])
+    tempo_seconds = np.concatenate(([0.], np.cumsum(np.diff(tempo_ticks) * 
+        tempos[: -1] / 1e6 / ticks_per_beat)))
+
+    # Channel messages in playback order
+    is_channel = (status >= 0x80) & (status < 0xf0)
+    indexes = np.nonzero(is_channel)[0]
+    indexes = indexes[np.argsort(ticks[indexes], kind='stable')]
+    (ticks, status, data1, data2, track_indexes) = (ticks[indexes], 
+        status[indexes], data1[indexes], data2[indexes], track_indexes[indexes])
+
+    tempo_indexes = np.searchsorted(tempo_ticks, ticks, side='right') - 1
+    hi = status & 0xf0
+
+    events = np.zeros(len(ticks), dtype=midi_event_dtype)
+    events['time_sec'] = tempo_seconds[tempo_indexes] + (ticks - 
+        tempo_ticks[tempo_indexes]) * tempos[tempo_indexes] / 1e6 / ticks_per_beat
+    events['tick'] = ticks
+    events['track'] = track_indexes
+    events['type'] = hi
+    events['channel'] = status & 0x0f
+
+    is_note = (hi == 0x80) | (hi == 0x90)
+    events['note'] = np.where(is_note | (hi == 0xa0), data1, -1)
+    events['velocity'] = np.where(is_note, data2, -1)
+    events['control'] = np.where(hi == 0xb0, data1, -1)
+    events['value'] = np.select([(hi == 0xa0) | (hi == 0xb0), 
+        (hi == 0xc0) | (hi == 0xd0), hi == 0xe0], 
+        [data2, data1, (data1 | (data2 << 7)) - 8192], -1)
+
+    return events, ticks_per_beat
+
+
+def encode_variable_ints(values):
+    """Encode non-negative integers as MIDI variable-length quantities.
+
+    Args:
+      values: (n,), int, less than 2 ** 28
+
+    Returns:
+      vlq: (n, 4), uint8, the bytes of each value, left-aligned
+      lengths: (n,), int, number of bytes of each value
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if np.any(values < 0) or np.any(values >= 2 ** 28):
+        raise ValueError('Variable-length quantities must be in [0, 2 ** 28).')
+
+    lengths = 1 + (values >= 2 ** 7) + (values >= 2 ** 14) + (values >= 2 ** 21)
+    vlq = np.zeros((len(values), 4), dtype=np.uint8)
+
+    for j in range(4):
+        # Byte j from the most significant, all but the last byte have the 
+        # high bit set
+        shift = 7 * np.maximum(lengths - 1 - j, 0)
+        vlq[:, j] = ((values >> shift) & 0x7f) | np.where(j < lengths - 1, 0x80, 0)
+
+    return vlq, lengths
+
+
+def get_midi_bytes(start_time, notes, pedals=None):
+    """Encode notes and pedals as a standard MIDI file, the same bytes as 
+    mido writes for the same messages, without creating the messages.
 
     Args:
       start_time: float
-      note_events: list of dict, e.g. [
-        {'midi_note': 51, 'onset_time': 696.63544, 'offset_time': 696.9948, 'velocity': 44}, 
-        {'midi_note': 58, 'onset_time': 696.99585, 'offset_time': 697.18646, 'velocity': 50}
-        ...]
-      midi_path: str
+      notes: (notes_num, 4), the four columns are onset_time, offset_time, 
+        MIDI note and MIDI velocity
+      pedals: None | (pedals_num, 2), the two columns are onset_time and 
+        offset_time
+
+    Returns:
+      midi_bytes: bytes
     """
-    from mido import Message, MidiFile, MidiTrack, MetaMessage
-    
     # This configuration is the same as MIDIs in MAESTRO dataset
     ticks_per_beat = 384
     beats_per_second = 2
     ticks_per_second = ticks_per_beat * beats_per_second
     microseconds_per_beat = int(1e6 // beats_per_second)
 
-    midi_file = MidiFile()
-    midi_file.ticks_per_beat = ticks_per_beat
+    notes = np.asarray(notes).reshape(-1, 4)
+    pedals = np.zeros((0, 2)) if pedals is None else np.asarray(pedals).reshape(-1, 2)
+
+    midi_notes = notes[:, 2].astype(np.int64)
+    velocities = notes[:, 3].astype(np.int64)
+    if np.any((midi_notes < 0) | (midi_notes > 127) | (velocities < 0) | 
+        (velocities > 127)):
+        raise ValueError('MIDI notes and velocities must be in [0, 127].')
+
+    # Each onset is followed by its offset, notes before pedals, the same 
+    # order as events are appended before sorting
+    times = [notes[:, 0 : 2].reshape(-1), pedals.reshape(-1)]
+
+    # (messages_num, 3), status, data1 and data2 of each message
+    messages = np.concatenate((
+        np.stack((np.full(len(notes) * 2, 0x90), np.repeat(midi_notes, 2), 
+            np.stack((velocities, np.zeros_like(velocities)), axis=-1).reshape(-1)), 
+            axis=-1), 
+        np.stack((np.full(len(pedals) * 2, 0xb0), np.full(len(pedals) * 2, 64), 
+            np.tile([127, 0], len(pedals))), axis=-1)), axis=0).astype(np.uint8)
+
+    # Ticks are calculated in the precision of the times, the same as 
+    # int((time - start_time) * ticks_per_second) of a single time
+    ticks = []
+    for x in times:
+        dtype = np.asarray((x.dtype.type(0) - start_time) * ticks_per_second).dtype
+        ticks.append(((x.astype(dtype) - dtype.type(start_time)) * 
+            dtype.type(ticks_per_second)).astype(np.int64))
+    ticks = np.concatenate(ticks)
+
+    # Sort by time, stable so that messages at the same time keep their order
+    indexes = np.argsort(np.concatenate([x.astype(np.float64) for x in times]), 
+        kind='stable')
+    indexes = indexes[ticks[indexes] >= 0]
+    (ticks, messages) = (ticks[indexes], messages[indexes])
+    diff_ticks = np.diff(ticks, prepend=0)
+
+    # Running status, the status byte is left out if it is the same as the
+    # status of the previous message
+    has_status = np.ones(len(messages), dtype=bool)
+    has_status[1 :] = messages[1 :, 0] != messages[: -1, 0]
+
+    (vlq, vlq_lengths) = encode_variable_ints(diff_ticks)
+    lengths = vlq_lengths + has_status + 2
+    offsets = np.cumsum(lengths) - lengths
+    data = np.zeros(np.sum(lengths), dtype=np.uint8)
+
+    for j in range(4):
+        mask = vlq_lengths > j
+        data[offsets[mask] + j] = vlq[mask, j]
+
+    positions = offsets + vlq_lengths
+    data[positions[has_status]] = messages[has_status, 0]
+    positions += has_status
+    data[positions] = messages[:, 1]
+    data[positions + 1] = messages[:, 2]
+
+    # Track 0: set_tempo, time_signature 4/4 and end_of_track after 1 tick
+    track0 = bytes([0, 0xff, 0x51, 3]) + microseconds_per_beat.to_bytes(3, 'big') + \
+        bytes([0, 0xff, 0x58, 4, 4, 2, 24, 8, 1, 0xff, 0x2f, 0])
+
+    # Track 1: notes and pedals, then end_of_track after 1 tick
+    track1 = data.tobytes() + bytes([1, 0xff, 0x2f, 0])
+
+    return b''.join([b'MThd', struct.pack('>IHHH', 6, 1, 2, ticks_per_beat), 
+        b'MTrk', struct.pack('>I', len(track0)), track0, 
+        b'MTrk', struct.pack('>I', len(track1)), track1])
 
-    # Track 0
-    track0 = MidiTrack()
-    track0.append(MetaMessage('set_tempo', tempo=microseconds_per_beat, time=0))
-    track0.append(MetaMessage('time_signature', numerator=4, denominator=4, time=0))
-    track0.append(MetaMessage('end_of_track', time=1))
-    midi_file.tracks.append(track0)
 
-    # Track 1
-    track1 = MidiTrack()
-    
-    # Message rolls of MIDI
-    message_roll = []
-
-    for note_event in note_events:
-        # Onset
-        message_roll.append({
-            'time': note_event['onset_time'], 
-            'midi_note': note_event['midi_note'], 
-            'velocity': note_event['velocity']})
-       
-        # Offset
-        message_roll.append({
-            'time': note_event['offset_time'], 
-            'midi_note': note_event['midi_note'], 
-            'velocity': 0})
-
-    if pedal_events:
-        for pedal_event in pedal_events:
-            message_roll.append({'time': pedal_event['onset_time'], 'control_change': 64, 'value': 127})
-            message_roll.append({'time': pedal_event['offset_time'], 'control_change': 64, 'value': 0})
-
-    # Sort MIDI messages by time
-    message_roll.sort(key=lambda note_event: note_event['time'])
-
-    previous_ticks = 0
-    for message in message_roll:
-        this_ticks = int((message['time'] - start_time) * ticks_per_second)
-        if this_ticks >= 0:
-            diff_ticks = this_ticks - previous_ticks
-            previous_ticks = this_ticks
-            if 'midi_note' in message.keys():
-                track1.append(Message('note_on', note=message['midi_note'], velocity=message['velocity'], time=diff_ticks))
-            elif 'control_change' in message.keys():
-                track1.append(Message('control_change', channel=0, control=message['control_change'], value=message['value'], time=diff_ticks))
-    track1.append(MetaMessage('end_of_track', time=1))
-    midi_file.tracks.append(track1)
-
-    midi_file.save(midi_path)
+def write_events_to_midi(start_time, note_events, pedal_events, midi_path):
+    """Write out note events to MIDI file.
+
+    Args:
+      start_time: float
+      note_events: list of dict | NoteTable, e.g. [
+        {'midi_note': 51, 'onset_time': 696.63544, 'offset_time': 696.9948, 'velocity': 44}, 
+        {'midi_note': 58, 'onset_time': 696.99585, 'offset_time': 697.18646, 'velocity': 50}
+        ...]
+      pedal_events: None | list of dict | PedalTable
+      midi_path: str | file object, e.g. io.BytesIO()
+    """
+    # Keep the dtype of the times, the ticks are calculated in it
+    if isinstance(note_events, NoteTable):
+        notes = note_events.get_array()
+    else:
+        onset_times = np.asarray([e['onset_time'] for e in note_events])
+        notes = np.zeros((len(note_events), 4), dtype=np.result_type(onset_times, 
+            np.float32))
+        notes[:, 0] = onset_times
+        notes[:, 1] = [e['offset_time'] for e in note_events]
+        notes[:, 2] = [e['midi_note'] for e in note_events]
+        notes[:, 3] = [e['velocity'] for e in note_events]
+
+    if isinstance(pedal_events, PedalTable):
+        pedals = pedal_events.get_array()
+    elif pedal_events:
+        pedals = np.array([[e['onset_time'], e['offset_time']] 
+            for e in pedal_events])
+    else:
+        pedals = None
+
+    midi_bytes = get_midi_bytes(start_time, notes, pedals)
+
+    if hasattr(midi_path, 'write'):
+        midi_path.write(midi_bytes)
+    else:
+        with open(midi_path, 'wb') as f:
+            f.write(midi_bytes)
+
+
+def get_slice_indexes(starts, lengths):
+    """Indexes of the concatenation of x[start : start + length] of each 
+    start and length."""
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(np.sum(lengths)) + np.repeat(starts - offsets, lengths)
+
+
+def split_midi_by_note(midi_path, notes=range(21, 109)):
+    """Split a MIDI file into one MIDI file per key, parsing it once. The 
+    file of a key has all messages but the note_on, note_off and polytouch 
+    messages of other keys, so that it renders the key alone with the 
+    tempos, pedals and track lengths of the original. Keys without note_on 
+    messages are left out.
+
+    Args:
+      midi_path: str | bytes, path or content of a MIDI file
+      notes: iterable of int, MIDI notes
+
+    Returns:
+      midi_bytes_dict: dict, e.g. {21: b'MThd...', 24: b'MThd...', ...}
+    """
+    (header, _, track_datas) = read_midi_chunks(midi_path)
+    tracks = []
+    played_notes = set()
+
+    for track_data in track_datas:
+        (ticks, status, data1, data2, _, _, status_positions, ends) = \
+            read_midi_track(track_data, positions=True)
+        x = np.frombuffer(track_data, dtype=np.uint8)
+        hi = status & 0xf0
+
+        # Channel messages are written with their status byte, meta and 
+        # sysex messages as they are
+        is_channel = (status >= 0x80) & (status < 0xf0)
+        lengths = np.where(is_channel, np.where((hi == 0xc0) | (hi == 0xd0), 2, 3), 
+            ends - status_positions)
+        offsets = np.cumsum(lengths) - lengths
+        bodies = np.zeros(np.sum(lengths), dtype=np.uint8)
+
+        bodies[get_slice_indexes(offsets[~is_channel], lengths[~is_channel])] = \
+            x[get_slice_indexes(status_positions[~is_channel], lengths[~is_channel])]
+        bodies[offsets[is_channel]] = status[is_channel]
+        bodies[offsets[is_channel] + 1] = data1[is_channel]
+        has_data2 = is_channel & (lengths == 3)
+        bodies[offsets[has_data2] + 2] = data2[has_data2]
+
+        # Note messages grouped by key, in the order of the track
+        is_note = (hi == 0x80) | (hi == 0x90) | (hi == 0xa0)
+        note_indexes = np.nonzero(is_note)[0]
+        note_indexes = note_indexes[np.argsort(data1[note_indexes], kind='stable')]
+        keys = data1[note_indexes]
+        played_notes.update(np.unique(data1[hi == 0x90]).tolist())
+
+        tracks.append({'ticks': ticks, 'bodies': bodies, 'offsets': offsets, 
+            'lengths': lengths, 'other_indexes': np.nonzero(~is_note)[0], 
+            'note_indexes': note_indexes, 'keys': keys, 'chunk': None})
+
+    def encode_track(track, indexes):
+        diff_ticks = np.diff(track['ticks'][indexes], prepend=0)
+        (vlq, vlq_lengths) = encode_variable_ints(diff_ticks)
+        body_lengths = track['lengths'][indexes]
+        lengths = vlq_lengths + body_lengths
+        offsets = np.cumsum(lengths) - lengths
+        data = np.zeros(np.sum(lengths), dtype=np.uint8)
+
+        for j in range(4):
+            mask = vlq_lengths > j
+            data[offsets[mask] + j] = vlq[mask, j]
+
+        data[get_slice_indexes(offsets + vlq_lengths, body_lengths)] = \
+            track['bodies'][get_slice_indexes(track['offsets'][indexes], body_lengths)]
+
+        return b'MTrk' + struct.pack('>I', len(data)) + data.tobytes()
+
+    midi_bytes_dict = {}
+
+    for note in notes:
+        if note not in played_notes:
+            continue
+
+        chunks = [header]
+
+        for track in tracks:
+            (begin, end) = np.searchsorted(track['keys'], [note, note + 1])
+
+            if begin < end:
+                indexes = np.sort(np.concatenate((track['other_indexes'], 
+                    track['note_indexes'][begin : end])))
+                chunks.append(encode_track(track, indexes))
+            else:
+                # Tracks without the key are the same for all keys
+                if track['chunk'] is None:
+                    track['chunk'] = encode_track(track, track['other_indexes'])
+                chunks.append(track['chunk'])
+
+        midi_bytes_dict[note] = b''.join(chunks)
+
+    return midi_bytes_dict
+
+
+def render_midi(midi_bytes, soundfont_path, sample_rate=44100, gain=None):
+    """Render a MIDI file with fluidsynth. The MIDI file and the rendered 
+    audio are passed in memory files instead of files on disk where the 
+    platform has them.
+
+    Args:
+      midi_bytes: bytes, e.g. a value of split_midi_by_note()
+      soundfont_path: str
+      sample_rate: int
+      gain: None | float, None for the fluidsynth default of 0.2
+
+    Returns:
+      audio: (samples_num,), float32, mono
+    """
+    def open_file(name):
+        if hasattr(os, 'memfd_create'):
+            return os.fdopen(os.memfd_create(name), 'w+b')
+        else:
+            return tempfile.TemporaryFile()
+
+    with open_file('midi') as midi_file, open_file('audio') as audio_file:
+        midi_file.write(midi_bytes)
+        midi_file.flush()
+        midi_file.seek(0)
+
+        cmd = ['fluidsynth', '-ni', soundfont_path, 
+            '/dev/fd/{}'.format(midi_file.fileno()), 
+            '-F', '/dev/fd/{}'.format(audio_file.fileno()), 
+            '-T', 'raw', '-O', 's16', '-r', str(sample_rate)]
+        if gain is not None:
+            cmd += ['-g', str(gain)]
+
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, 
+            pass_fds=(midi_file.fileno(), audio_file.fileno()))
+
+        audio_file.seek(0)
+        audio = np.frombuffer(audio_file.read(), dtype=np.int16)
+
+    # Interleaved stereo
+    audio = audio.reshape(-1, 2)
+    return int16_to_float32(audio.astype(np.float32).mean(axis=-1))
 
 import numpy as np
 from . import config
 from .piano_vad import note_detection_with_onset_offset_regress, pedal_detection_with_onset_offset_regress
 
+def get_note_drift(ref_note_events, est_note_events, onset_tolerance=0.05):
+    """Compare estimated notes with reference notes. A reference and an 
+    estimated note match if they have the same MIDI note and their onsets
+    are within onset_tolerance, each note matching at most once.
+
+    Args:
+      ref_note_events: list of dict, e.g. [
+        {'midi_note': 51, 'onset_time': 696.63544, 'offset_time': 696.9948, 'velocity': 44}, 
+        ...]
+      est_note_events: list of dict
+      onset_tolerance: float, seconds
+
+    Returns:
+      drift_dict: dict, {'precision': float, 'recall': float, 'f1': float, 
+        'velocity_mae': float, mean absolute MIDI velocity difference of 
+        matched notes}
+    """
+    matched_num = 0
+    velocity_errors = []
+
+    for midi_note in set(e['midi_note'] for e in ref_note_events):
+        refs = sorted((e['onset_time'], e['velocity']) for e in ref_note_events 
+            if e['midi_note'] == midi_note)
+        ests = sorted((e['onset_time'], e['velocity']) for e in est_note_events 
+            if e['midi_note'] == midi_note)
+
+        # Greedy matching in onset order
+        j = 0
+        for (onset_time, velocity) in refs:
+            while j < len(ests) and ests[j][0] < onset_time - onset_tolerance:
+                j += 1
+            if j < len(ests) and ests[j][0] <= onset_time + onset_tolerance:
+                matched_num += 1
+                velocity_errors.append(abs(ests[j][1] - velocity))
+                j += 1
+
+    precision = matched_num / max(len(est_note_events), 1)
+    recall = matched_num / max(len(ref_note_events), 1)
+    f1 = 2 * precision * recall / max(precision + recall, 1e-8)
+    velocity_mae = float(np.mean(velocity_errors)) if velocity_errors else 0.
+
+    return {'precision': precision, 'recall': recall, 'f1': f1, 
+        'velocity_mae': velocity_mae}
+
+
+def logistic_inverse(y, L, k, x0, b):
+    """Inverse of the logistic velocity curve of a soundfont key, fitted by 
+    4_POSTPROCESS_MIDI.ipynb, for many velocities at once.
+
+    Args:
+      y: (n,), MIDI velocities
+      L, k, x0, b: float, coefficients of the key
+
+    Returns:
+      x: (n,), int, MIDI velocities in [1, 127], -1 where the inverse is 
+        undefined
+    """
+    y = np.asarray(y, dtype=np.float64)
+    x = np.full(y.shape, -1, dtype=np.int64)
+
+    # A flat curve has no inverse
+    if k == 0:
+        return x
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inner = (L / (y - b)) - 1
+        valid = (y != b) & (inner > 0)
+        result = y[valid] * (x0 - (1 / k) * np.log(inner[valid]))
+
+    x[valid] = np.clip(result, 1, 127).astype(np.int64)
+    return x
+
+
+def read_velocity_coefficients(coefficients_path):
+    """Read the coefficients of a soundfont, one line per MIDI note: 
+    note, L, k, x0 and b. Lines that cannot be parsed are skipped, and the 
+    first line of a note is used.
+
+    Returns:
+      coefficients: dict, {midi_note: (L, k, x0, b)}
+    """
+    coefficients = {}
+
+    with open(coefficients_path, 'r') as f:
+        for line in f:
+            values = line.split()
+            try:
+                midi_note = int(values[0])
+                coeffs = tuple(float(v) for v in values[1 : 5])
+            except (IndexError, ValueError):
+                continue
+            if len(coeffs) == 4 and midi_note not in coefficients:
+                coefficients[midi_note] = coeffs
+
+    return coefficients
+
+
+def get_velocity_table(soundfont, coefficients_dir=None):
+    """Lookup table of velocities of a soundfont from 
+    coefficients_dir/{soundfont}_coefficients.txt, the same velocities as 
+    modify_velocities_by_note() of 4_POSTPROCESS_MIDI.ipynb. Built once per 
+    soundfont and directory.
+
+    Velocity 0, notes without coefficients and velocities where the inverse 
+    is undefined keep their velocity.
+
+    Args:
+      soundfont: str, e.g. 'Yamaha_C5'
+      coefficients_dir: None | str, default config.coefficients_dir
+
+    Returns:
+      velocity_table: (classes_num, 128), int, read-only, velocity_table[
+        midi_note - begin_note, velocity] is the remapped velocity
+    """
+    if coefficients_dir is None:
+        coefficients_dir = config.coefficients_dir
+
+    return _get_velocity_table(soundfont, os.path.abspath(coefficients_dir))
+
+
+@functools.lru_cache(maxsize=None)
+def _get_velocity_table(soundfont, coefficients_dir):
+    coefficients = read_velocity_coefficients(os.path.join(coefficients_dir, 
+        '{}_coefficients.txt'.format(soundfont)))
+
+    velocities = np.arange(128)
+    velocity_table = np.tile(velocities, (config.classes_num, 1))
+
+    for midi_note in coefficients.keys():
+        piano_note = midi_note - config.begin_note
+        if 0 <= piano_note < config.classes_num:
+            x = logistic_inverse(velocities[1 :], *coefficients[midi_note])
+            velocity_table[piano_note, 1 :] = np.where(x >= 0, x, velocities[1 :])
+
+    velocity_table.setflags(write=False)
+    return velocity_table
+
+
 class RegressionPostProcessor(object):
     def __init__(self, frames_per_second, classes_num, onset_threshold, 
-                 offset_threshold, frame_threshold, pedal_offset_threshold):
+                 offset_threshold, frame_threshold, pedal_offset_threshold, 
+                 velocity_table=None):
         """Postprocess the output probabilities of a transcription model to MIDI 
         events.
 
@@ -173,6 +795,9 @@ class RegressionPostProcessor(object):
           offset_threshold: float
           frame_threshold: float
           pedal_offset_threshold: float
+          velocity_table: None | (classes_num, 128), MIDI velocity of each 
+            piano note and MIDI velocity, e.g. get_velocity_table('Yamaha_C5').
+            None keeps the velocities.
         """
         self.frames_per_second = frames_per_second
         self.classes_num = classes_num
@@ -182,8 +807,9 @@ class RegressionPostProcessor(object):
         self.pedal_offset_threshold = pedal_offset_threshold
         self.begin_note = config.begin_note
         self.velocity_scale = config.velocity_scale
+        self.velocity_table = velocity_table
 
-    def output_dict_to_midi_events(self, output_dict):
+    def output_dict_to_midi_events(self, output_dict, tables=False):
         """Main function. Post process model outputs to MIDI events.
 
         Args:
@@ -195,6 +821,8 @@ class RegressionPostProcessor(object):
             'reg_pedal_onset_output': (segment_frames, 1), 
             'reg_pedal_offset_output': (segment_frames, 1), 
             'pedal_frame_output': (segment_frames, 1)}
+          tables: bool, return a NoteTable and a PedalTable instead of lists
+            of dict
 
         Outputs:
           est_note_events: list of dict, e.g. [
@@ -217,11 +845,16 @@ class RegressionPostProcessor(object):
         # Uncomment the following line to print them.
         est_on_off_note_vels = self.print_velocities(est_on_off_note_vels)
 
-        # Reformat notes to MIDI events
-        est_note_events = self.detected_notes_to_events(est_on_off_note_vels)
+        if tables:
+            est_note_events = self.detected_notes_to_table(est_on_off_note_vels)
+        else:
+            # Reformat notes to MIDI events
+            est_note_events = self.detected_notes_to_events(est_on_off_note_vels)
 
         if est_pedal_on_offs is None:
             est_pedal_events = None
+        elif tables:
+            est_pedal_events = self.detected_pedals_to_table(est_pedal_on_offs)
         else:
             est_pedal_events = self.detected_pedals_to_events(est_pedal_on_offs)
 
@@ -263,7 +896,7 @@ class RegressionPostProcessor(object):
                 reg_output=output_dict['reg_onset_output'], 
                 threshold=self.onset_threshold, neighbour=2)
 
-        output_dict['onset_output'] = onset_output  # Values are 0 or 1
+        output_dict['onset_output'] = onset_output  # Values are False or True
         output_dict['onset_shift_output'] = onset_shift_output  
 
         # Calculate binarized offset output from regression output
@@ -272,7 +905,7 @@ class RegressionPostProcessor(object):
                 reg_output=output_dict['reg_offset_output'], 
                 threshold=self.offset_threshold, neighbour=4)
 
-        output_dict['offset_output'] = offset_output  # Values are 0 or 1
+        output_dict['offset_output'] = offset_output  # Values are False or True
         output_dict['offset_shift_output'] = offset_shift_output
 
         if 'reg_pedal_onset_output' in output_dict.keys():
@@ -288,14 +921,14 @@ class RegressionPostProcessor(object):
                     reg_output=output_dict['reg_pedal_offset_output'], 
                     threshold=self.pedal_offset_threshold, neighbour=4)
 
-            output_dict['pedal_offset_output'] = pedal_offset_output  # Values are 0 or 1
+            output_dict['pedal_offset_output'] = pedal_offset_output  # Values are False or True
             output_dict['pedal_offset_shift_output'] = pedal_offset_shift_output
 
         # ------ 2. Process matrices results to event results ------
         # Detect piano notes from output_dict
         est_on_off_note_vels = self.output_dict_to_detected_notes(output_dict)
 
-        if 'reg_pedal_onset_output' in output_dict.keys():
+        if 'pedal_frame_output' in output_dict.keys():
             # Detect piano pedals from output_dict
             est_pedal_on_offs = self.output_dict_to_detected_pedals(output_dict)
         else:
@@ -351,30 +984,72 @@ class RegressionPostProcessor(object):
           neighbour: int
 
         Returns:
-          binary_output: (frames_num, classes_num)
+          binary_output: (frames_num, classes_num), bool
           shift_output: (frames_num, classes_num)
         """
-        binary_output = np.zeros_like(reg_output)
+        binary_output = np.zeros(reg_output.shape, dtype=bool)
         shift_output = np.zeros_like(reg_output)
-        (frames_num, classes_num) = reg_output.shape
-        
-        for k in range(classes_num):
-            x = reg_output[:, k]
-            for n in range(neighbour, frames_num - neighbour):
-                if x[n] > threshold and self.is_monotonic_neighbour(x, n, neighbour):
-                    binary_output[n, k] = 1
-
-                    """See Section III-D in [1] for deduction.
-                    [1] Q. Kong, et al., High-resolution Piano Transcription 
-                    with Pedals by Regressing Onsets and Offsets Times, 2020."""
-                    if x[n - 1] > x[n + 1]:
-                        shift = (x[n + 1] - x[n - 1]) / (x[n] - x[n + 1]) / 2
-                    else:
-                        shift = (x[n + 1] - x[n - 1]) / (x[n] - x[n - 1]) / 2
-                    shift_output[n, k] = shift
+
+        (n, k, shift) = self.get_regression_peaks(reg_output, neighbour)
+        keep = reg_output[n, k] > threshold
+        (n, k) = (n[keep], k[keep])
+
+        binary_output[n, k] = True
+        shift_output[n, k] = shift[keep]
 
         return binary_output, shift_output
 
+    def get_regression_peaks(self, reg_output, neighbour):
+        """Find the peaks of the regression results of any value, i.e. frames 
+        monotonic in both sides, and their shifts. The threshold of 
+        get_binarized_output_from_regression() only selects among them, so 
+        the peaks are shared by all thresholds.
+
+        Args:
+          reg_output: (frames_num, classes_num)
+          neighbour: int
+
+        Returns:
+          n: (peaks_num,), frame indexes
+          k: (peaks_num,), class indexes
+          shift: (peaks_num,)
+        """
+        (frames_num, classes_num) = reg_output.shape
+
+        if frames_num <= 2 * neighbour:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0, dtype=reg_output.dtype)
+
+        # Candidates are frames n in [neighbour, frames_num - neighbour) of all
+        # classes, x[n] is aligned with rows of the views below
+        x = reg_output
+        begin, end = neighbour, frames_num - neighbour
+        peak = np.ones((end - begin, classes_num), dtype=bool)
+
+        # Same test as is_monotonic_neighbour, written as "not less than" so 
+        # that NaNs behave the same way as in the scalar version
+        for i in range(neighbour):
+            peak &= ~(x[begin - i : end - i] < x[begin - i - 1 : end - i - 1])
+            peak &= ~(x[begin + i : end + i] < x[begin + i + 1 : end + i + 1])
+
+        (n, k) = np.nonzero(peak)
+        n += begin
+
+        """See Section III-D in [1] for deduction.
+        [1] Q. Kong, et al., High-resolution Piano Transcription 
+        with Pedals by Regressing Onsets and Offsets Times, 2020."""
+        (x_prev, x_curr, x_next) = (x[n - 1, k], x[n, k], x[n + 1, k])
+        denominator = np.where(x_prev > x_next, x_curr - x_next, x_curr - x_prev)
+
+        # A flat peak, x_prev == x_curr == x_next, has no slope to 
+        # interpolate and is centred, instead of a NaN shift that would make 
+        # the time of its note NaN
+        denominator[denominator == 0] = 1
+        with np.errstate(invalid='ignore'):
+            shift = (x_next - x_prev) / denominator / 2
+
+        return n, k, shift
+
     def is_monotonic_neighbour(self, x, n, neighbour):
         """Detect if values are monotonic in both sides of x[n].
 
@@ -432,6 +1107,20 @@ class RegressionPostProcessor(object):
             est_tuples += est_tuples_per_note
             est_midi_notes += [piano_note + self.begin_note] * len(est_tuples_per_note)
 
+        return self.note_tuples_to_array(est_tuples, est_midi_notes)
+
+    def note_tuples_to_array(self, est_tuples, est_midi_notes):
+        """Convert detected note tuples to an array of notes in seconds.
+
+        Args:
+          est_tuples: list of [bgn, fin, onset_shift, offset_shift, 
+            normalized_velocity], frame indexes from the start of the recording
+          est_midi_notes: list of int
+
+        Returns:
+          est_on_off_note_vels: (notes, 4), the four columns are onset_time, 
+            offset_time, MIDI note and velocity
+        """
         est_tuples = np.array(est_tuples)   # (notes, 5)
         """(notes, 5), the five columns are onset, offset, onset_shift, 
         offset_shift and normalized_velocity"""
@@ -476,6 +1165,19 @@ class RegressionPostProcessor(object):
             offset_shift_output=output_dict['pedal_offset_shift_output'][:, 0], 
             frame_threshold=0.5)
 
+        return self.pedal_tuples_to_array(est_tuples)
+
+    def pedal_tuples_to_array(self, est_tuples):
+        """Convert detected pedal tuples to an array of pedals in seconds.
+
+        Args:
+          est_tuples: list of [bgn, fin, onset_shift, offset_shift], frame 
+            indexes from the start of the recording
+
+        Returns:
+          est_on_off: (pedals, 2), the two columns are pedal onsets and pedal
+            offsets
+        """
         est_tuples = np.array(est_tuples)
         if len(est_tuples) == 0:
             return np.array([])
@@ -502,17 +1204,68 @@ class RegressionPostProcessor(object):
              {'onset_time': 11.9824, 'offset_time': 12.50, 'midi_note': 33, 'velocity': 88},
              ...]
         """
+        x = np.asarray(est_on_off_note_vels).reshape(-1, 4)
+        midi_notes = x[:, 2].astype(np.int64)
+        velocities = self.get_midi_velocities(midi_notes, x[:, 3]).tolist()
+
         midi_events = []
-        for i in range(est_on_off_note_vels.shape[0]):
+        for i in range(x.shape[0]):
             midi_events.append({
-                'onset_time': est_on_off_note_vels[i][0], 
-                'offset_time': est_on_off_note_vels[i][1], 
-                'midi_note': int(est_on_off_note_vels[i][2]), 
-                'velocity': int(est_on_off_note_vels[i][3] * self.velocity_scale)
+                'onset_time': x[i][0], 
+                'offset_time': x[i][1], 
+                'midi_note': int(midi_notes[i]), 
+                'velocity': velocities[i]
             })
 
         return midi_events
 
+    def get_midi_velocities(self, midi_notes, velocities):
+        """MIDI velocities of normalized velocities, remapped by 
+        velocity_table. Velocities of 0 or above 127 are not remapped.
+
+        Args:
+          midi_notes: (notes,), int
+          velocities: (notes,), in [0, 1]
+
+        Returns:
+          midi_velocities: (notes,), int
+        """
+        midi_velocities = (velocities * self.velocity_scale).astype(np.int64)
+
+        if self.velocity_table is not None:
+            remap = (midi_velocities > 0) & (midi_velocities < 128)
+            midi_velocities[remap] = self.velocity_table[
+                midi_notes[remap] - self.begin_note, midi_velocities[remap]]
+
+        return midi_velocities
+
+    def detected_notes_to_table(self, est_on_off_note_vels):
+        """The same as detected_notes_to_events(), as columns.
+
+        Args:
+          est_on_off_note_vels: (notes, 4)
+
+        Returns:
+          note_table: NoteTable
+        """
+        x = np.asarray(est_on_off_note_vels).reshape(-1, 4)
+        midi_notes = x[:, 2].astype(np.int64)
+        return NoteTable(onset_time=x[:, 0], offset_time=x[:, 1], 
+            midi_note=midi_notes, 
+            velocity=self.get_midi_velocities(midi_notes, x[:, 3]))
+
+    def detected_pedals_to_table(self, pedal_on_offs):
+        """The same as detected_pedals_to_events(), as columns.
+
+        Args:
+          pedal_on_offs: (pedals, 2)
+
+        Returns:
+          pedal_table: PedalTable
+        """
+        x = np.asarray(pedal_on_offs).reshape(-1, 2)
+        return PedalTable(onset_time=x[:, 0], offset_time=x[:, 1])
+
     def detected_pedals_to_events(self, pedal_on_offs):
         """Reformat detected pedal onsets and offsets to events.
 
@@ -539,6 +1292,211 @@ class RegressionPostProcessor(object):
         return pedal_events
 
 
+class StreamingRegressionPostProcessor(RegressionPostProcessor):
+    def __init__(self, frames_per_second, classes_num, onset_threshold, 
+                 offset_threshold, frame_threshold, pedal_offset_threshold, 
+                 velocity_table=None):
+        """Postprocess model outputs that arrive block by block to MIDI events.
+        An event is returned as soon as later frames can no longer change it, 
+        and all events together are the same as RegressionPostProcessor 
+        returns for the whole recording.
+
+        Only the frames still needed to close pending notes and pedals are 
+        kept. Each key is searched from a window start just before its 
+        pending onset, and the pedal from the offset of the last pedal.
+
+        Args:
+          frames_per_second: int
+          classes_num: int
+          onset_threshold: float
+          offset_threshold: float
+          frame_threshold: float
+          pedal_offset_threshold: float
+          velocity_table: None | (classes_num, 128), see RegressionPostProcessor
+        """
+        super(StreamingRegressionPostProcessor, self).__init__(
+            frames_per_second, classes_num, onset_threshold, offset_threshold, 
+            frame_threshold, pedal_offset_threshold, velocity_table)
+
+        # Regression outputs need 4 frames on each side to be binarized
+        self.context_frames = 4
+
+        self.note_buffer = {}
+        self.note_buffer_start = 0  # Frame index of the first buffered frame
+        self.note_starts = [0] * classes_num    # Search window start of each key
+
+        self.pedal_buffer = {}
+        self.pedal_buffer_start = 0
+        self.pedal_start = 0
+
+    def update(self, output_dict, final=False):
+        """Append the next deframed model outputs and return the closed events.
+
+        Args:
+          output_dict: {
+            'reg_onset_output': (frames_num, classes_num), 
+            'reg_offset_output': (frames_num, classes_num), 
+            'frame_output': (frames_num, classes_num), 
+            'velocity_output': (frames_num, classes_num), 
+            ...}, frames following the previously updated frames
+          final: bool, True if these are the last frames of the recording
+
+        Returns:
+          est_note_events: list of dict
+          est_pedal_events: list of dict | None
+        """
+        for key in output_dict.keys():
+            buffer = self.pedal_buffer if 'pedal' in key else self.note_buffer
+            if key in buffer.keys():
+                buffer[key] = np.concatenate((buffer[key], output_dict[key]), axis=0)
+            else:
+                buffer[key] = output_dict[key]
+
+        est_note_events = self.detected_notes_to_events(
+            self.update_detected_notes(final))
+
+        if 'pedal_frame_output' in self.pedal_buffer.keys():
+            est_pedal_events = self.detected_pedals_to_events(
+                self.update_detected_pedals(final))
+        else:
+            est_pedal_events = None
+
+        return est_note_events, est_pedal_events
+
+    def update_detected_notes(self, final):
+        """Detect notes closed within the buffered frames.
+
+        Args:
+          final: bool
+
+        Returns:
+          est_on_off_note_vels: (notes, 4)
+        """
+        buffer = self.note_buffer
+        frames_num = buffer['frame_output'].shape[0]
+        end = frames_num if final else frames_num - self.context_frames
+
+        (onset_output, onset_shift_output) = \
+            self.get_binarized_output_from_regression(
+                reg_output=buffer['reg_onset_output'], 
+                threshold=self.onset_threshold, neighbour=2)
+
+        (offset_output, offset_shift_output) = \
+            self.get_binarized_output_from_regression(
+                reg_output=buffer['reg_offset_output'], 
+                threshold=self.offset_threshold, neighbour=4)
+
+        est_tuples = []
+        est_midi_notes = []
+
+        for piano_note in range(self.classes_num):
+            bgn = self.note_starts[piano_note] - self.note_buffer_start
+            if end - bgn < 2:
+                continue
+
+            est_tuples_per_note = note_detection_with_onset_offset_regress(
+                frame_output=buffer['frame_output'][bgn : end, piano_note], 
+                onset_output=onset_output[bgn : end, piano_note], 
+                onset_shift_output=onset_shift_output[bgn : end, piano_note], 
+                offset_output=offset_output[bgn : end, piano_note], 
+                offset_shift_output=offset_shift_output[bgn : end, piano_note], 
+                velocity_output=buffer['velocity_output'][bgn : end, piano_note], 
+                frame_threshold=self.frame_threshold)
+
+            """A note ending in the last frame of the window may be cut by the 
+            window, so it is searched again with more frames. Notes do not 
+            overlap, so it can only be the last note."""
+            if not final and est_tuples_per_note and \
+                est_tuples_per_note[-1][1] == end - bgn - 1:
+                next_start = est_tuples_per_note.pop()[0] - 1
+            else:
+                next_start = end - bgn - 2
+
+            for est_tuple in est_tuples_per_note:
+                est_tuples.append([est_tuple[0] + self.note_starts[piano_note], 
+                    est_tuple[1] + self.note_starts[piano_note]] + est_tuple[2 :])
+                est_midi_notes.append(piano_note + self.begin_note)
+
+            self.note_starts[piano_note] += next_start
+
+        # Drop frames that are no longer searched
+        self.note_buffer_start = self.trim_buffer(self.note_buffer, 
+            self.note_buffer_start, min(self.note_starts))
+
+        return self.note_tuples_to_array(est_tuples, est_midi_notes)
+
+    def update_detected_pedals(self, final):
+        """Detect pedals closed within the buffered frames.
+
+        Args:
+          final: bool
+
+        Returns:
+          est_on_off: (pedals, 2)
+        """
+        buffer = self.pedal_buffer
+        frames_num = buffer['pedal_frame_output'].shape[0]
+        end = frames_num if final else frames_num - self.context_frames
+
+        (pedal_offset_output, pedal_offset_shift_output) = \
+            self.get_binarized_output_from_regression(
+                reg_output=buffer['reg_pedal_offset_output'], 
+                threshold=self.pedal_offset_threshold, neighbour=4)
+
+        bgn = self.pedal_start - self.pedal_buffer_start
+        est_tuples = pedal_detection_with_onset_offset_regress(
+            frame_output=buffer['pedal_frame_output'][bgn : end, 0], 
+            offset_output=pedal_offset_output[bgn : end, 0], 
+            offset_shift_output=pedal_offset_shift_output[bgn : end, 0], 
+            frame_threshold=0.5)
+
+        for est_tuple in est_tuples:
+            est_tuple[0] += self.pedal_start
+            est_tuple[1] += self.pedal_start
+
+        if est_tuples:
+            """A pedal is closed at its offset, or 10 frames after the frame 
+            disappears if no offset is found before."""
+            fin = est_tuples[-1][1]
+            if pedal_offset_output[fin - self.pedal_buffer_start, 0] == 1:
+                self.pedal_start = fin
+            else:
+                self.pedal_start = fin + 10
+
+        """The next pedal starts at the first rise after the search start. If 
+        none is pending, only the last frame is needed to find a rise in the 
+        next frames."""
+        bgn = self.pedal_start - self.pedal_buffer_start
+        frame_output = buffer['pedal_frame_output'][bgn : end, 0]
+        rises = np.nonzero((frame_output[1 :] >= 0.5) & 
+            (frame_output[1 :] > frame_output[: -1]))[0]
+
+        if len(rises) > 0:
+            self.pedal_start += int(rises[0])
+        else:
+            self.pedal_start = max(self.pedal_start, 
+                self.pedal_buffer_start + end - 1)
+
+        self.pedal_buffer_start = self.trim_buffer(self.pedal_buffer, 
+            self.pedal_buffer_start, self.pedal_start)
+
+        return self.pedal_tuples_to_array(est_tuples)
+
+    def trim_buffer(self, buffer, buffer_start, search_start):
+        """Drop buffered frames before search_start, keeping the frames needed
+        to binarize the regression outputs.
+
+        Returns:
+          buffer_start: int
+        """
+        new_buffer_start = max(search_start - self.context_frames, buffer_start)
+
+        for key in buffer.keys():
+            buffer[key] = buffer[key][new_buffer_start - buffer_start :]
+
+        return new_buffer_start
+
+
 def load_audio(path, sr=22050, mono=True, offset=0.0, duration=None,
     dtype=np.float32, res_type='kaiser_best', 
     backends=[audioread.ffdec.FFmpegAudioFile]):
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+import torch
+
+from piano_transcription_inference.models import Note_pedal
+from piano_transcription_inference.pytorch_utils import (export_for_inference,
+    quantize_dynamic)
+
+
+def get_model():
+    torch.manual_seed(1234)
+    model = Note_pedal(frames_per_second=100, classes_num=88)
+
+    # Statistics away from the initial ones, so that folding changes weights
+    for module in model.modules():
+        if isinstance(module, (torch.nn.BatchNorm1d, torch.nn.BatchNorm2d)):
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2.)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.5, 0.5)
+
+    return model.eval()
+
+
+def test_exported_outputs_equal_eager(tmp_path):
+    model = get_model()
+    script_path = str(tmp_path / 'model.pt')
+    segment_samples = 16000
+
+    export_for_inference(model, segment_samples, script_path)
+    traced_model = torch.jit.load(script_path)
+
+    # The exported model runs other batch sizes than the traced one
+    x = torch.rand(3, segment_samples) * 2. - 1.
+    with torch.no_grad():
+        ref_output_dict = model(x)
+        output_dict = traced_model(x)
+
+    assert sorted(output_dict.keys()) == sorted(ref_output_dict.keys())
+    for key in ref_output_dict.keys():
+        np.testing.assert_allclose(output_dict[key].numpy(),
+            ref_output_dict[key].numpy(), atol=1e-4)
+
+    # The eager model is not folded
+    assert any(isinstance(module, torch.nn.BatchNorm2d)
+        for module in model.modules())
+
+
+def test_quantized_model_is_not_exported(tmp_path):
+    model = quantize_dynamic(get_model())
+
+    with pytest.raises(ValueError):
+        export_for_inference(model, 16000, str(tmp_path / 'model.pt'))
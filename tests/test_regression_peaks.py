@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+
+from piano_transcription_inference.utilities import RegressionPostProcessor
+
+
+class LoopPostProcessor(object):
+    """get_binarized_output_from_regression() and is_monotonic_neighbour()
+    before they were vectorized, copied verbatim."""
+
+    def get_binarized_output_from_regression(self, reg_output, threshold, neighbour):
+        """Calculate binarized output and shifts of onsets or offsets from the
+        regression results.
+
+        Args:
+          reg_output: (frames_num, classes_num)
+          threshold: float
+          neighbour: int
+
+        Returns:
+          binary_output: (frames_num, classes_num)
+          shift_output: (frames_num, classes_num)
+        """
+        binary_output = np.zeros_like(reg_output)
+        shift_output = np.zeros_like(reg_output)
+        (frames_num, classes_num) = reg_output.shape
+
+        for k in range(classes_num):
+            x = reg_output[:, k]
+            for n in range(neighbour, frames_num - neighbour):
+                if x[n] > threshold and self.is_monotonic_neighbour(x, n, neighbour):
+                    binary_output[n, k] = 1
+
+                    """See Section III-D in [1] for deduction.
+                    [1] Q. Kong, et al., High-resolution Piano Transcription
+                    with Pedals by Regressing Onsets and Offsets Times, 2020."""
+                    if x[n - 1] > x[n + 1]:
+                        shift = (x[n + 1] - x[n - 1]) / (x[n] - x[n + 1]) / 2
+                    else:
+                        shift = (x[n + 1] - x[n - 1]) / (x[n] - x[n - 1]) / 2
+                    shift_output[n, k] = shift
+
+        return binary_output, shift_output
+
+    def is_monotonic_neighbour(self, x, n, neighbour):
+        """Detect if values are monotonic in both sides of x[n].
+
+        Args:
+          x: (frames_num,)
+          n: int
+          neighbour: int
+
+        Returns:
+          monotonic: bool
+        """
+        monotonic = True
+        for i in range(neighbour):
+            if x[n - i] < x[n - i - 1]:
+                monotonic = False
+            if x[n + i] < x[n + i + 1]:
+                monotonic = False
+
+        return monotonic
+
+
+def get_reg_outputs():
+    random_state = np.random.RandomState(1234)
+    frames_num, classes_num = 300, 8
+
+    # Triangles around random onsets, as regressed by the model, with noise
+    onsets = random_state.uniform(0, frames_num, (20, 1, classes_num))
+    distances = np.abs(np.arange(frames_num)[None, :, None] - onsets)
+    peaks = np.max(np.clip(1 - distances / 5, 0, 1), axis=0) + \
+        random_state.uniform(0, 0.05, (frames_num, classes_num))
+
+    # Few levels give many plateaus and flat peaks
+    plateaus = np.round(random_state.uniform(0, 1, (frames_num, classes_num)) * 4) / 4
+
+    nans = random_state.uniform(0, 1, (frames_num, classes_num))
+    nans[random_state.uniform(0, 1, nans.shape) < 0.05] = np.nan
+
+    return {'peaks': peaks.astype(np.float32),
+        'plateaus': plateaus.astype(np.float32),
+        'plateaus_float16': plateaus.astype(np.float16),
+        'nans': nans.astype(np.float32)}
+
+
+def get_post_processor(classes_num):
+    return RegressionPostProcessor(frames_per_second=100,
+        classes_num=classes_num, onset_threshold=0.3, offset_threshold=0.3,
+        frame_threshold=0.1, pedal_offset_threshold=0.2)
+
+
+@pytest.mark.parametrize('name', sorted(get_reg_outputs().keys()))
+@pytest.mark.parametrize('neighbour', [2, 4])
+@pytest.mark.parametrize('threshold', [0.1, 0.3])
+def test_binarized_output_equals_loop(name, neighbour, threshold):
+    reg_output = get_reg_outputs()[name]
+
+    (binary_output, shift_output) = get_post_processor(
+        reg_output.shape[1]).get_binarized_output_from_regression(
+        reg_output, threshold, neighbour)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        (ref_binary_output, ref_shift_output) = \
+            LoopPostProcessor().get_binarized_output_from_regression(
+            reg_output, threshold, neighbour)
+
+    assert np.any(ref_binary_output)
+
+    # Flat peaks, x_prev == x_curr == x_next, are centred instead of NaN
+    flat = np.zeros(reg_output.shape, dtype=bool)
+    flat[1 : -1] = (reg_output[: -2] == reg_output[1 : -1]) & \
+        (reg_output[1 : -1] == reg_output[2 :])
+    ref_shift_output[(ref_binary_output == 1) & flat] = 0
+
+    # Binary outputs are bool instead of 0. and 1. of the dtype of reg_output
+    np.testing.assert_array_equal(binary_output, ref_binary_output.astype(bool),
+        strict=True)
+    np.testing.assert_array_equal(shift_output, ref_shift_output, strict=True)
+
+
+def test_flat_peak_is_centred():
+    reg_output = np.array([0., 0.2, 0.5, 0.5, 0.5, 0.2, 0.], dtype=np.float32)[:, None]
+
+    (binary_output, shift_output) = get_post_processor(
+        1).get_binarized_output_from_regression(reg_output, threshold=0.3,
+        neighbour=2)
+
+    # Every frame of the plateau is monotonic on both sides, the middle one
+    # is flat and the loop gave it a NaN shift
+    np.testing.assert_array_equal(binary_output[:, 0], [0, 0, 1, 1, 1, 0, 0])
+    np.testing.assert_array_equal(shift_output[:, 0],
+        np.array([0., 0., 0.5, 0., -0.5, 0., 0.], dtype=np.float32), strict=True)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        (_, ref_shift_output) = LoopPostProcessor().get_binarized_output_from_regression(
+            reg_output, threshold=0.3, neighbour=2)
+    assert np.isnan(ref_shift_output[3, 0])